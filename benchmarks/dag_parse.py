@@ -0,0 +1,102 @@
+"""
+DAG parse-time benchmark
+
+Purpose:
+- measures how long it takes to parse (import) DAG files, as the scheduler does on every processing of the DAG folder
+- runs every parse in a fresh interpreter with Airflow already imported, so only the DAG file itself is measured
+- reports heavy libraries imported and files opened under /opt/expdir/data while parsing, optionally saved as JSON
+
+Usage: python benchmarks/dag_parse.py [dags/etl_dag.py ...] [--runs 5] [--output dag_parse.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+# Libraries which should be imported only when tasks run
+heavy_modules = ["pandas", "numpy", "pyarrow", "sqlalchemy", "psycopg2", "openpyxl"]
+
+# Files opened under this directory while parsing are reported (e.g. log files of ETL scripts)
+data_dir = "/opt/expdir/data"
+
+default_dag_files = ["dags/etl_dag.py", "dags/etl_inprocess_dag.py"]
+
+# Run in a fresh interpreter: imports Airflow (as the scheduler has it imported already), then parses the DAG file
+probe = """
+import importlib.util, json, os, sys, time
+
+dag_file, data_dir, heavy_modules = sys.argv[1], sys.argv[2], sys.argv[3].split(",")
+started = time.perf_counter()
+try:
+    import airflow
+    from airflow.operators.python_operator import PythonOperator
+    airflow_import_s = time.perf_counter() - started
+except ImportError:
+    airflow_import_s = None
+preloaded = set(sys.modules)
+
+opened = []
+def audit(event, args):
+    if event == "open" and isinstance(args[0], str) and os.path.abspath(args[0]).startswith(data_dir):
+        opened.append(args[0])
+sys.addaudithook(audit)
+
+# Airflow puts the DAG folder on sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(dag_file)))
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("dag_under_benchmark", dag_file)
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+parse_s = time.perf_counter() - started
+
+imported = [name for name in heavy_modules if name in sys.modules and name not in preloaded]
+print(json.dumps({"parse_s": parse_s, "airflow_import_s": airflow_import_s, "heavy_modules": imported, "opened_files": sorted(set(opened))}))
+"""
+
+
+def parse_once(dag_file):
+    # Parses the DAG file in a fresh interpreter and returns the measurements
+    result = subprocess.run(
+        [sys.executable, "-c", probe, dag_file, data_dir, ",".join(heavy_modules)],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"parsing {dag_file} failed: {result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark(dag_file, runs):
+    # Parses the DAG file `runs` times and summarizes parse times (seconds)
+    results = [parse_once(dag_file) for _ in range(runs)]
+    parse_times = [result["parse_s"] for result in results]
+    return {
+        "dag_file": dag_file,
+        "runs": runs,
+        "parse_s_median": round(statistics.median(parse_times), 6),
+        "parse_s_min": round(min(parse_times), 6),
+        "parse_s_max": round(max(parse_times), 6),
+        "heavy_modules": results[-1]["heavy_modules"],
+        "opened_files": results[-1]["opened_files"],
+    }
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Measures parse time of Airflow DAG files")
+    parser.add_argument("dag_files", nargs="*", default=default_dag_files)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="JSON file to save the results to")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = [benchmark(dag_file, args.runs) for dag_file in args.dag_files]
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
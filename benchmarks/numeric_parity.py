@@ -0,0 +1,96 @@
+"""
+Numeric cleaning parity check
+
+Purpose:
+- checks that transform.clean_numeric_columns (arrow kernels, RE2 regexes) gives the same results as the chain it replaced:
+  remove_symbols, extract_numbers and convert_to_numeric (pandas, Python regexes)
+- covers dirty values of the source data ($12k+, $1k2, 95%, $32.00, missing values, plain numbers) and values on which
+  the two regex engines differ, such as non-ASCII digits (Python's \\d matches them, RE2's \\d doesn't)
+- optionally adds random mixtures of those values (--rows), and reports timing of both versions
+
+Usage: python benchmarks/numeric_parity.py [--rows 100000] [--seed 0]
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+scripts_dir = os.path.join(repo_dir, "scripts")
+
+numeric_cols = ["job_success_perc", "earnings_in_thousands", "price_per_hour", "completed_jobs", "total_hours"]
+
+# Raw values as they come in the staging data, plus edge cases of the regexes
+dirty_values = [
+    "$12k+",
+    "$1k2",
+    "95%",
+    "$32.00",
+    np.nan,
+    None,
+    "12.5",
+    7,
+    7.0,
+    "0",
+    "",
+    "abc",
+    "k+",
+    "99999999999999999999",
+    "١٢",  # Arabic-Indic digits (12)
+    "$٣٢.00",  # Arabic-Indic digits followed by ASCII digits
+    "１２%",  # fullwidth digits (12)
+    "४5",  # Devanagari digit followed by an ASCII digit
+]
+
+
+def dirty_frame(rows=0, seed=0):
+    # Every dirty value in every column, followed by `rows` random mixtures of them
+    rng = np.random.default_rng(seed)
+    data = {}
+    for col in numeric_cols:
+        picks = rng.integers(0, len(dirty_values), rows)
+        data[col] = pd.Series(dirty_values + [dirty_values[i] for i in picks], dtype=object)
+    return pd.DataFrame(data)
+
+
+def compare(df):
+    # Runs both versions on copies of the frame and returns (mismatches, timings)
+    # Mismatches are (column, raw value, old result, new result); results are compared as floats, NaN equal to NaN
+    sys.path.insert(0, scripts_dir)
+    from transform import remove_symbols, extract_numbers, convert_to_numeric, clean_numeric_columns
+
+    start = time.perf_counter()
+    old = convert_to_numeric(extract_numbers(remove_symbols(df.copy())))
+    old_time = time.perf_counter() - start
+    start = time.perf_counter()
+    new = clean_numeric_columns(df.copy())
+    new_time = time.perf_counter() - start
+
+    mismatches = []
+    for col in numeric_cols:
+        old_values = old[col].astype("float64").to_numpy()
+        new_values = new[col].astype("float64").to_numpy()
+        different = ~((old_values == new_values) | (np.isnan(old_values) & np.isnan(new_values)))
+        for i in np.flatnonzero(different):
+            mismatches.append((col, df[col].iloc[i], old_values[i], new_values[i]))
+    return mismatches, {"old_s": round(old_time, 4), "new_s": round(new_time, 4)}
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Checks clean_numeric_columns against the chain it replaced")
+    parser.add_argument("--rows", type=int, default=0, help="random rows added to the dirty values")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    mismatches, timings = compare(dirty_frame(args.rows, args.seed))
+    for col, value, old_value, new_value in mismatches[:20]:
+        print(f"{col}: {value!r} -> old {old_value}, new {new_value}")
+    print(f"{len(mismatches)} mismatches, timings: {timings}")
+    sys.exit(1 if mismatches else 0)
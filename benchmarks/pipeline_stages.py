@@ -0,0 +1,196 @@
+"""
+Pipeline stages benchmark
+
+Purpose:
+- measures every pipeline stage (extraction, validation of extracted data, transformation, validation of transformed data, loading)
+  on synthetic workbooks of several sizes (see synthetic_data.py)
+- runs every size in a fresh interpreter, handing the data over between the stages in memory (as scripts/pipeline.py does),
+  and reports wall time, CPU time, rows, peak RSS and RSS (after the stage and its change) of every stage, optionally with
+  bytes allocated by Python (tracemalloc)
+- loads into a throwaway Postgres database given by --dsn (or ETL_BENCHMARK_DSN), recreating user_schema/star_schema from init.sql
+  before every size. Without the DSN the load stage is skipped. Never point it at the warehouse, its data is dropped
+- saves the results as JSON, so they can be compared with a saved baseline (--baseline)
+
+Usage: python benchmarks/pipeline_stages.py [--sizes 4x300 4x5000 8x25000] [--dsn postgresql://...] [--output results.json]
+       [--baseline benchmarks/baseline.json] [--trace-memory]
+A throwaway database can be started with: docker run --rm -d -p 5433:5432 -e POSTGRES_PASSWORD=bench postgres:13
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from synthetic_data import generate_workbook
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+scripts_dir = os.path.join(repo_dir, "scripts")
+init_sql_path = os.path.join(repo_dir, "init.sql")
+
+# Sizes as <sheets>x<rows per sheet>
+default_sizes = ["4x300", "4x5000", "8x25000"]
+
+# Values of every stage compared with the baseline
+compared_values = ["wall_time_s", "cpu_time_s", "peak_rss_bytes", "rss_after_bytes"]
+
+
+def parse_size(size):
+    sheets, rows = size.lower().split("x")
+    return int(sheets), int(rows)
+
+
+def init_statements(path=None):
+    # Statements of init.sql creating schemas and tables of the warehouse
+    # psql commands, creation of databases and grants (roles of the docker setup) are left out
+    with open(path or init_sql_path) as f:
+        lines = [line for line in f.read().splitlines() if not line.strip().startswith(("--", "\\"))]
+    statements = [statement.strip() for statement in "\n".join(lines).split(";")]
+    return [
+        statement
+        for statement in statements
+        if statement and not statement.upper().startswith(("CREATE DATABASE", "GRANT"))
+    ]
+
+
+def reset_database(dsn):
+    # Drops and recreates the warehouse schemas in the throwaway database
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(dsn)
+    try:
+        with engine.begin() as connection:
+            connection.execute(text("DROP SCHEMA IF EXISTS user_schema, star_schema CASCADE"))
+            for statement in init_statements():
+                connection.execute(text(statement))
+    finally:
+        engine.dispose()
+
+
+def run_stages(workbook, dsn=None, trace_memory=False):
+    # Runs the stages on the workbook in the current process and returns metrics of every stage
+    # (and of every transformation step, as recorded by metrics.track)
+    import tracemalloc
+
+    sys.path.insert(0, scripts_dir)
+    import extract
+    import load
+    import metrics
+    from transform import transform_data
+    from validate_extraction import validate_extracted_data
+    from validate_transformation import validate_transformed_data
+
+    extract.paths = [workbook]
+    if dsn:
+        load.CONNECTION_STRING = dsn
+
+    # Every stage takes the dataframe of the previous stage and returns the one for the next stage
+    def validated(validate):
+        def stage(df):
+            validate(data=df)
+            return df
+
+        return stage
+
+    def load_stage(df):
+        if not load.load_data(data=df):
+            raise RuntimeError("Failed to load data")
+        return df
+
+    stages = [
+        ("extract", lambda _: extract.extract_data(save=False)),
+        ("validate_extraction", validated(validate_extracted_data)),
+        ("transform", lambda df: transform_data(df, save=False)),
+        ("validate_transformation", validated(validate_transformed_data)),
+    ]
+    if dsn:
+        stages.append(("load", load_stage))
+
+    if trace_memory:
+        tracemalloc.start()
+    df = None
+    for name, stage in stages:
+        with metrics.track(f"benchmark.{name}", rows_in=None if df is None else len(df)) as record:
+            if trace_memory:
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+            df = stage(df)
+            record["rows_out"] = len(df)
+            if trace_memory:
+                record["allocated_bytes"] = tracemalloc.get_traced_memory()[1] - before
+
+    stages = [
+        dict(record, stage=record["stage"][len("benchmark.") :])
+        for record in metrics.records
+        if record["stage"].startswith("benchmark.")
+    ]
+    steps = [record for record in metrics.records if record["stage"].startswith("transform_data.")]
+    return {"stages": stages, "steps": steps}
+
+
+def benchmark_size(size, workdir, dsn=None, trace_memory=False):
+    # Generates the workbook (once per size) and runs the stages in a fresh interpreter
+    sheets, rows = parse_size(size)
+    workbook = os.path.join(workdir, f"synthetic_{sheets}x{rows}.xlsx")
+    if not os.path.exists(workbook):
+        generate_workbook(workbook, sheets, rows)
+    if dsn:
+        reset_database(dsn)
+
+    command = [sys.executable, os.path.abspath(__file__), "--probe", workbook]
+    if dsn:
+        command += ["--dsn", dsn]
+    if trace_memory:
+        command.append("--trace-memory")
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"benchmark of {size} failed: {result.stderr.strip() or result.stdout.strip()[-2000:]}")
+    return {"size": size, "sheets": sheets, "rows": sheets * rows, **json.loads(result.stdout.strip().splitlines()[-1])}
+
+
+def compare(report, baseline):
+    # Ratios of current to baseline values for every size and stage present in both (e.g. 1.25 is 25% slower)
+    baseline_stages = {(run["size"], stage["stage"]): stage for run in baseline for stage in run["stages"]}
+    comparison = []
+    for run in report:
+        for stage in run["stages"]:
+            previous = baseline_stages.get((run["size"], stage["stage"]))
+            if previous is None:
+                continue
+            ratios = {value: round(stage[value] / previous[value], 3) for value in compared_values if previous.get(value)}
+            comparison.append({"size": run["size"], "stage": stage["stage"], **ratios})
+    return comparison
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Measures pipeline stages on synthetic data of several sizes")
+    parser.add_argument("--sizes", nargs="+", default=default_sizes, help="sizes as <sheets>x<rows per sheet>")
+    parser.add_argument("--dsn", default=os.environ.get("ETL_BENCHMARK_DSN"), help="throwaway Postgres database for the load stage")
+    parser.add_argument("--workdir", help="directory for generated workbooks (default: temporary directory)")
+    parser.add_argument("--trace-memory", action="store_true", help="also measure bytes allocated by Python (slower)")
+    parser.add_argument("--output", help="JSON file to save the results to")
+    parser.add_argument("--baseline", help="JSON file with results of an earlier run to compare with")
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.probe:
+        print(json.dumps(run_stages(args.probe, args.dsn, args.trace_memory)))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        workdir = args.workdir or temp_dir
+        os.makedirs(workdir, exist_ok=True)
+        report = [benchmark_size(size, workdir, args.dsn, args.trace_memory) for size in args.sizes]
+    summary = [{"size": run["size"], "rows": run["rows"], "stages": run["stages"]} for run in report]
+    print(json.dumps(summary, indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            print(json.dumps(compare(report, json.load(f)), indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
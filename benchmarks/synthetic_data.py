@@ -0,0 +1,109 @@
+"""
+Synthetic source data
+
+Purpose:
+- generates excel workbooks shaped like data/source.xlsx (columns of extract.required_columns read from the sheets), of any size
+- one sheet per country (sheet names as in the source, e.g. Serbia0), every sheet with the same number of rows
+- keeps dirty values of the real data: earnings such as $12k+ or $1k2, percentages (95%), prices ($32.00), missing values,
+  missing user IDs and users repeated within and across the sheets
+
+Usage: python benchmarks/synthetic_data.py data/synthetic.xlsx [--sheets 4] [--rows 300] [--seed 0]
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+
+
+# Sheets of the generated workbooks, cycled when more sheets are requested (sheet name, city, region)
+countries = [
+    ("Serbia", "Belgrade", "Europe"),
+    ("Croatia", "Zagreb", "Europe"),
+    ("Bosnia", "Sarajevo", "Europe"),
+    ("Germany", "Berlin", "Europe"),
+    ("Canada", "Toronto", "North America"),
+    ("Brazil", "Sao Paulo", "South America"),
+    ("Japan", "Tokyo", "Asia"),
+    ("Kenya", "Nairobi", "Africa"),
+]
+
+# Shares of missing values per column, roughly as in the source data
+missing_shares = {
+    "User ID": 0.03,
+    "Earnings": 0.3,
+    "Job_Success": 0.35,
+    "Ratings": 0.6,
+    "Total_Hours": 0.15,
+    "Price_per_hour": 0.5,
+    "Main profession": 0.4,
+    "Completed_Jobs": 0.3,
+}
+
+
+def with_missing(rng, values, share):
+    # Replaces given share of the values with NaN
+    values = pd.Series(values, dtype=object)
+    values[rng.random(len(values)) < share] = np.nan
+    return values
+
+
+def earnings(rng, rows):
+    # Mostly "$<n>k+", with some "$1k2" and plain numbers, as in the source data
+    values = np.array([f"${n}k+" for n in rng.integers(1, 100, rows)], dtype=object)
+    kind = rng.random(rows)
+    values[kind < 0.1] = "$1k2"
+    values[(kind >= 0.1) & (kind < 0.15)] = "5"
+    return values
+
+
+def generate_sheet(rng, rows, country, city, region, users):
+    # One sheet of the workbook. User IDs are drawn from `users` IDs, so some users are repeated
+    data = {
+        "User ID": [f"u{n}" for n in rng.integers(1, users + 1, rows)],
+        "Pol": rng.integers(0, 2, rows),
+        "Earnings": earnings(rng, rows),
+        "Job_Success": [f"{n}%" for n in rng.integers(0, 101, rows)],
+        "Ratings": np.full(rows, "Top Rated", dtype=object),
+        "Total_Hours": rng.integers(1, 5000, rows).astype(float),
+        "Price_per_hour": [f"${n}.00" for n in rng.integers(5, 100, rows)],
+        "Main profession": rng.integers(1, 4, rows).astype(float),
+        "Title": np.full(rows, "dev", dtype=object),
+        "Country": np.full(rows, country, dtype=object),
+        "City": np.full(rows, city, dtype=object),
+        "Completed_Jobs": rng.integers(0, 300, rows).astype(float),
+        "Region": np.full(rows, region, dtype=object),
+    }
+    df = pd.DataFrame(data)
+    for col, share in missing_shares.items():
+        df[col] = with_missing(rng, df[col], share)
+    for col in ["Total_Hours", "Main profession", "Completed_Jobs"]:
+        df[col] = df[col].astype(float)
+    return df
+
+
+def generate_workbook(path, sheets=4, rows=300, seed=0):
+    # Writes the workbook with `sheets` sheets of `rows` rows and returns total number of rows
+    # Users are drawn from a pool smaller than the number of rows of a sheet, so duplicates appear within and across sheets
+    rng = np.random.default_rng(seed)
+    users = max(1, int(rows * 0.9))
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for i in range(sheets):
+            country, city, region = countries[i % len(countries)]
+            df = generate_sheet(rng, rows, country, city, region, users)
+            df.to_excel(writer, sheet_name=f"{country}{i}", index=False)
+    return sheets * rows
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Generates a synthetic source workbook")
+    parser.add_argument("path", help="excel file to write")
+    parser.add_argument("--sheets", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=300, help="rows per sheet")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    total = generate_workbook(args.path, args.sheets, args.rows, args.seed)
+    print(f"{args.path}: {args.sheets} sheets, {total} rows")
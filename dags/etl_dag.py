@@ -2,15 +2,18 @@ from airflow import DAG
 from airflow.operators.python_operator import PythonOperator
 from airflow.utils.dates import days_ago
 from datetime import timedelta
+import os
 import sys
 
 sys.path.insert(0, "/opt/expdir/scripts")
 
-from extract import extract_data
-from transform import load_staging_data, transform_data
-from load import load_data
-from validate_extraction import validate_extracted_data
-from validate_transformation import validate_transformed_data
+# ETL scripts (and pandas, pyarrow, SQLAlchemy... imported by them) are imported inside the tasks, not while the DAG file is parsed
+# See benchmarks/dag_parse.py for the parse time of DAG files
+
+# Fan-out: sheets are discovered at run time and extracted, validated and transformed as parallel (mapped) tasks,
+# transformed parts are assembled by a single task. Otherwise (default) the whole dataset is processed by each task
+# Fan-out doesn't support streaming, incremental and chunked modes, a run with any of them enabled fails (see discover_sheets_task)
+fan_out = os.environ.get("ETL_DAG_FAN_OUT", "false").lower() == "true"
 
 
 # DAG arguments
@@ -34,47 +37,123 @@ with DAG(
     max_active_runs=1,
     ) as dag:
 
+    # Metrics recorded by a task are appended to the per-run metrics file and pushed to XCom (key: metrics)
+    def push_metrics(context):
+        from metrics import write_metrics
+
+        context["ti"].xcom_push(key="metrics", value=write_metrics(context["dag_run"].run_id))
+
     # Defining tasks:
     # Extraction task
-    def extract_task():
-        extract_data()
+    def extract_task(**context):
+        from extract import extract_data
+
+        try:
+            extract_data()
+        finally:
+            push_metrics(context)
 
     # Validation extraction task
-    def validate_extraction_task():
-        validate_extracted_data()
+    def validate_extraction_task(**context):
+        from validate_extraction import validate_extracted_data
+
+        try:
+            validate_extracted_data()
+        finally:
+            push_metrics(context)
 
     # Transformation task
-    def transform_task():
-        staging_df = load_staging_data()
-        if staging_df is not None:
-            transform_data(staging_df)
-        else:
-            raise ValueError("Failed to load staging data")
+    def transform_task(**context):
+        from transform import chunked_mode, load_staging_data, transform_data, transform_in_chunks
+
+        try:
+            if chunked_mode:
+                transform_in_chunks()
+                return
+            staging_df = load_staging_data()
+            if staging_df is not None:
+                transform_data(staging_df)
+            else:
+                raise ValueError("Failed to load staging data")
+        finally:
+            push_metrics(context)
+
+    # Sheet discovery task, its result (one dict per sheet) is the input of mapped tasks
+    def discover_sheets_task(**context):
+        from extract import discover_sheets, streaming_mode, incremental_mode
+        from transform import chunked_mode
+
+        if streaming_mode or incremental_mode or chunked_mode:
+            raise ValueError(
+                "ETL_DAG_FAN_OUT can't be combined with ETL_EXTRACT_STREAMING, ETL_EXTRACT_INCREMENTAL or ETL_TRANSFORM_CHUNKED"
+            )
+        return discover_sheets()
+
+    # Per-sheet tasks (mapped), each returns the sheet description for the next mapped task
+    def extract_sheet_task(index, path, sheet_name, **context):
+        from extract import extract_sheet
+
+        try:
+            return extract_sheet(index, path, sheet_name)
+        finally:
+            push_metrics(context)
+
+    def validate_sheet_task(index, path, sheet_name, **context):
+        from staging import part_staging_path
+        from validate_extraction import validate_extracted_data
+
+        try:
+            validate_extracted_data(path=part_staging_path(index))
+            return {"index": index, "path": path, "sheet_name": sheet_name}
+        finally:
+            push_metrics(context)
+
+    def transform_sheet_task(index, path, sheet_name, **context):
+        from transform import transform_part
+
+        try:
+            return transform_part(index)
+        finally:
+            push_metrics(context)
+
+    # Fan-in task, assembles transformed parts of all the sheets
+    def assemble_task(parts, **context):
+        from transform import assemble_parts
+
+        try:
+            assemble_parts(list(parts))
+        finally:
+            push_metrics(context)
 
     # Validation transformation task
-    def validate_transformation_task():
-        validate_transformed_data()
+    def validate_transformation_task(**context):
+        from validate_transformation import validate_transformed_data
+
+        try:
+            validate_transformed_data()
+        finally:
+            push_metrics(context)
 
     # Loading task
-    def load_task():
-        load_data()
+    def load_task(**context):
+        from load import load_data
 
-    # PythonOperators
-    extract = PythonOperator(
-        task_id="extract",
-        python_callable=extract_task,
-    )
+        try:
+            if not load_data():
+                raise RuntimeError("Failed to load data")
+        finally:
+            push_metrics(context)
 
-    validate_extraction = PythonOperator(
-        task_id="validate_extraction",
-        python_callable=validate_extraction_task,
-    )
+    # Analytics task, pre-warms the cache of analytics results for the freshly loaded data
+    def warm_analytics_task(**context):
+        from analytics import warm_cache
 
-    transform = PythonOperator(
-        task_id="transform",
-        python_callable=transform_task,
-    )
+        try:
+            warm_cache()
+        finally:
+            push_metrics(context)
 
+    # PythonOperators
     validate_transformation = PythonOperator(
         task_id="validate_transformation",
         python_callable=validate_transformation_task,
@@ -85,5 +164,56 @@ with DAG(
         python_callable=load_task,
     )
 
-    # Task dependencies
-    extract >> validate_extraction >> transform >> validate_transformation >> load
+    warm_analytics = PythonOperator(
+        task_id="warm_analytics",
+        python_callable=warm_analytics_task,
+    )
+
+    if fan_out:
+        discover_sheets = PythonOperator(
+            task_id="discover_sheets",
+            python_callable=discover_sheets_task,
+        )
+
+        # Every mapped task starts once all instances of the previous mapped task are finished
+        extract_sheet = PythonOperator.partial(
+            task_id="extract_sheet",
+            python_callable=extract_sheet_task,
+        ).expand(op_kwargs=discover_sheets.output)
+
+        validate_sheet = PythonOperator.partial(
+            task_id="validate_sheet",
+            python_callable=validate_sheet_task,
+        ).expand(op_kwargs=extract_sheet.output)
+
+        transform_sheet = PythonOperator.partial(
+            task_id="transform_sheet",
+            python_callable=transform_sheet_task,
+        ).expand(op_kwargs=validate_sheet.output)
+
+        assemble = PythonOperator(
+            task_id="assemble",
+            python_callable=assemble_task,
+            op_kwargs={"parts": transform_sheet.output},
+        )
+
+        # Task dependencies
+        assemble >> validate_transformation >> load >> warm_analytics
+    else:
+        extract = PythonOperator(
+            task_id="extract",
+            python_callable=extract_task,
+        )
+
+        validate_extraction = PythonOperator(
+            task_id="validate_extraction",
+            python_callable=validate_extraction_task,
+        )
+
+        transform = PythonOperator(
+            task_id="transform",
+            python_callable=transform_task,
+        )
+
+        # Task dependencies
+        extract >> validate_extraction >> transform >> validate_transformation >> load >> warm_analytics
@@ -0,0 +1,47 @@
+from airflow import DAG
+from airflow.operators.python_operator import PythonOperator
+from airflow.utils.dates import days_ago
+from datetime import timedelta
+import sys
+
+sys.path.insert(0, "/opt/expdir/scripts")
+
+# ETL scripts are imported inside the task, not while the DAG file is parsed (see dags/etl_dag.py)
+
+
+# DAG arguments
+default_args = {
+    "owner": "marko",
+    "depends_on_past": False,
+    "email_on_failure": False,
+    "email_on_retry": False,
+    "retries": 1,
+    "retry_delay": timedelta(minutes=5),
+}
+
+# Whole pipeline in a single task, data is handed over between the stages in memory (see scripts/pipeline.py)
+with DAG(
+    "etl_pipeline_inprocess",
+    default_args=default_args,
+    description="etl pipeline in a single process",
+    start_date=days_ago(1),
+    schedule_interval=None,
+    tags=["test"],
+    catchup=False,
+    max_active_runs=1,
+    ) as dag:
+
+    # Pipeline task, metrics of all the stages are pushed to XCom (key: metrics)
+    def pipeline_task(**context):
+        from pipeline import run_pipeline
+        from metrics import write_metrics
+
+        try:
+            run_pipeline()
+        finally:
+            context["ti"].xcom_push(key="metrics", value=write_metrics(context["dag_run"].run_id))
+
+    pipeline = PythonOperator(
+        task_id="pipeline",
+        python_callable=pipeline_task,
+    )
@@ -50,7 +50,116 @@ CREATE TABLE IF NOT EXISTS user_schema.geo (
     country_code VARCHAR(255),
     FOREIGN KEY (pid) REFERENCES user_schema.user (pid));
 
+-- Rollup tables, summarising the data per (measure_code, country) slice for the dashboards (see sql_scripts/dashboard_queries.sql)
+-- Maintained by the load step, which recomputes only the slices touched by the loaded data. Sums and counts are kept
+-- instead of averages, so the slices can be added up to any level (country, whole sample)
+
+CREATE TABLE IF NOT EXISTS user_schema.rollup_country (
+    measure_code VARCHAR(255),
+    country VARCHAR(255),
+    users INT,
+    earnings_sum FLOAT,
+    earnings_count INT,
+    price_sum FLOAT,
+    price_count INT,
+    job_success_sum FLOAT,
+    job_success_count INT,
+    PRIMARY KEY (measure_code, country));
+
+CREATE TABLE IF NOT EXISTS user_schema.rollup_gender_country (
+    measure_code VARCHAR(255),
+    country VARCHAR(255),
+    gender VARCHAR(255),
+    users INT,
+    PRIMARY KEY (measure_code, country, gender));
+
+CREATE TABLE IF NOT EXISTS user_schema.rollup_profession_country (
+    measure_code VARCHAR(255),
+    country VARCHAR(255),
+    profession_class VARCHAR(255),
+    users INT,
+    price_sum FLOAT,
+    price_count INT,
+    PRIMARY KEY (measure_code, country, profession_class));
+
+CREATE TABLE IF NOT EXISTS user_schema.rollup_top_earners (
+    measure_code VARCHAR(255),
+    country VARCHAR(255),
+    rank INT,
+    pid VARCHAR(255),
+    profession_class VARCHAR(255),
+    earnings_in_thousands FLOAT,
+    PRIMARY KEY (measure_code, country, rank));
+
+-- Indexes used to recompute rollups of a slice (users of a measure_code/country and their rows in child tables)
+CREATE INDEX IF NOT EXISTS user_measure_code_idx ON user_schema.user (measure_code);
+CREATE INDEX IF NOT EXISTS geo_country_idx ON user_schema.geo (country, pid);
+CREATE INDEX IF NOT EXISTS geo_pid_idx ON user_schema.geo (pid);
+CREATE INDEX IF NOT EXISTS earnings_pid_idx ON user_schema.earnings (pid);
+CREATE INDEX IF NOT EXISTS jobs_pid_idx ON user_schema.jobs (pid);
+
+-- Version of the warehouse data, incremented by every successful load (cached analytics results of older versions are stale)
+CREATE TABLE IF NOT EXISTS user_schema.warehouse_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMP);
+
+INSERT INTO user_schema.warehouse_version (version, updated_at) VALUES (0, NOW()) ON CONFLICT (id) DO NOTHING;
+
+-- Star schema (optional layout, loaded when ETL_LOAD_STAR_SCHEMA=true): one fact row per user with integer surrogate key,
+-- profession class, country and region moved into small dimension tables referenced by indexed integer keys
+CREATE SCHEMA IF NOT EXISTS star_schema;
+
+CREATE TABLE IF NOT EXISTS star_schema.dim_profession (
+    profession_key INT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    main_profession VARCHAR(255) UNIQUE NOT NULL,
+    profession_class VARCHAR(255));
+
+INSERT INTO star_schema.dim_profession (main_profession, profession_class) VALUES
+    ('1.0', 'Clerical and data entry'),
+    ('2.0', 'Creative and multimedia'),
+    ('3.0', 'Professional services'),
+    ('4.0', 'Sales and marketing support'),
+    ('5.0', 'Software dev and tech'),
+    ('6.0', 'Writing and translation')
+ON CONFLICT (main_profession) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS star_schema.dim_country (
+    country_key INT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    country VARCHAR(255) NOT NULL,
+    country_code VARCHAR(255) NOT NULL,
+    UNIQUE (country, country_code));
+
+CREATE TABLE IF NOT EXISTS star_schema.dim_region (
+    region_key INT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    region VARCHAR(255) UNIQUE NOT NULL);
+
+CREATE TABLE IF NOT EXISTS star_schema.fact_user (
+    user_key INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    pid VARCHAR(255) UNIQUE NOT NULL,
+    user_id VARCHAR(255),
+    gender VARCHAR(255),
+    measure_code VARCHAR(255),
+    rating VARCHAR(255),
+    earnings_in_thousands FLOAT,
+    price_per_hour FLOAT,
+    total_hours INT,
+    job_success_perc FLOAT,
+    job_title VARCHAR(255),
+    completed_jobs INT,
+    city VARCHAR(255),
+    profession_key INT REFERENCES star_schema.dim_profession (profession_key),
+    country_key INT REFERENCES star_schema.dim_country (country_key),
+    region_key INT REFERENCES star_schema.dim_region (region_key));
+
+CREATE INDEX IF NOT EXISTS fact_user_profession_key_idx ON star_schema.fact_user (profession_key);
+CREATE INDEX IF NOT EXISTS fact_user_country_key_idx ON star_schema.fact_user (country_key);
+CREATE INDEX IF NOT EXISTS fact_user_region_key_idx ON star_schema.fact_user (region_key);
+
 -- Privileges/permissions
 GRANT ALL PRIVILEGES ON SCHEMA user_schema TO myuser;
 GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA user_schema TO myuser;
-GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA user_schema TO myuser;
\ No newline at end of file
+GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA user_schema TO myuser;
+GRANT ALL PRIVILEGES ON SCHEMA star_schema TO myuser;
+GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA star_schema TO myuser;
+GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA star_schema TO myuser;
\ No newline at end of file
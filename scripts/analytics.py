@@ -0,0 +1,197 @@
+"""
+Analytics queries
+
+Purpose:
+- parses the named queries from sql_scripts/analytics_queries.sql (name is the comment preceding the query)
+- runs the queries in parallel over a pool of DB connections
+- caches query results, keyed by the warehouse version which is bumped by every successful load (see load.py)
+- pre-warms the cache right after a load, so dashboard reads are served from the cache until new data arrives
+  (only with ETL_ANALYTICS_CACHE=true, which also makes loads bump the warehouse version)
+- a failing query is logged and left out of the results, the other queries are still run and cached
+"""
+
+import pandas as pd
+import logging
+import os
+import re
+import sys
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, text
+from load import CONNECTION_STRING, ANALYTICS_CACHE
+from metrics import track
+
+
+# Set-up logging
+def setup_logger():
+    log_file_path = "/opt/expdir/data/etl_analytics_process.log"
+    logger = logging.getLogger("data_analytics")
+    logger.setLevel(logging.INFO)
+
+    # Handlers are added once per process, the log file is opened with the first message (not at import)
+    if logger.handlers:
+        return logger
+
+    file_handler = logging.FileHandler(log_file_path, delay=True)
+    console_handler = logging.StreamHandler(sys.stdout)
+
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    file_handler.setFormatter(formatter)
+    console_handler.setFormatter(formatter)
+
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+
+    return logger
+
+
+logger = setup_logger()
+
+# File with named analytics queries
+queries_path = "/opt/expdir/sql_scripts/analytics_queries.sql"
+
+# Cached results, one directory per warehouse version (parquet file per query), plus results cached in this process
+cache_dir = "/opt/expdir/data/analytics_cache"
+memory_cache = {}
+
+# Number of queries run at the same time (and size of the connection pool)
+max_workers = int(os.environ.get("ETL_ANALYTICS_WORKERS", "4"))
+
+
+def query_name(comment):
+    # Query name made of its comment, e.g. "Number of users" -> number_of_users
+    return re.sub(r"[^a-z0-9]+", "_", comment.lower()).strip("_")
+
+
+def parse_queries(path=None):
+    # Returns {name: sql} of all the queries in the file, in file order
+    # Name is made of the first line of the last comment block preceding the query
+    path = path or queries_path
+    with open(path) as f:
+        content = f.read()
+    queries = {}
+    for statement in content.split(";"):
+        comment = []
+        sql = []
+        block_ended = False
+        for line in statement.splitlines():
+            stripped = line.strip()
+            if stripped.startswith("--") and not sql:
+                if block_ended:
+                    comment, block_ended = [], False
+                comment.append(stripped.lstrip("-").strip())
+            elif not stripped:
+                block_ended = True
+            else:
+                sql.append(line)
+        if not sql:
+            continue
+        name = query_name(comment[0]) if comment else f"query_{len(queries) + 1}"
+        while name in queries:
+            name += "_"
+        queries[name] = "\n".join(sql)
+    return queries
+
+
+def create_pool_engine(workers=None):
+    # DB engine whose connection pool holds a connection for every worker
+    workers = workers or max_workers
+    return create_engine(CONNECTION_STRING, pool_size=workers, max_overflow=0)
+
+
+def warehouse_version(engine):
+    # Version of the warehouse data, bumped by every successful load (see load.bump_warehouse_version)
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT version FROM user_schema.warehouse_version")).scalar_one()
+
+
+def cache_path(version, name):
+    return os.path.join(cache_dir, str(version), f"{name}.parquet")
+
+
+def read_cached(version, name):
+    # Cached result of a query (from this process or from the cache directory), None if not cached
+    if (version, name) in memory_cache:
+        return memory_cache[(version, name)]
+    path = cache_path(version, name)
+    if not os.path.exists(path):
+        return None
+    df = pd.read_parquet(path)
+    memory_cache[(version, name)] = df
+    return df
+
+
+def write_cached(version, name, df):
+    # Caches a result. The file is written under a temporary name and renamed, so readers never see partial files
+    os.makedirs(os.path.dirname(cache_path(version, name)), exist_ok=True)
+    temp_path = cache_path(version, name) + f".{os.getpid()}.tmp"
+    df.to_parquet(temp_path, index=False)
+    os.replace(temp_path, cache_path(version, name))
+    memory_cache[(version, name)] = df
+
+
+def run_query(engine, name, sql):
+    # Runs a single query over a pooled connection. Returns None (and logs the error) if the query fails
+    try:
+        with engine.connect() as connection:
+            return pd.read_sql_query(text(sql), connection)
+    except Exception as e:
+        logger.error(f"Error: analytics query {name} failed: {str(e)}")
+        return None
+
+
+def get_results(names=None, engine=None, refresh=False):
+    # Returns {name: dataframe} for given (or all) queries. Results of the current warehouse version are read from the cache,
+    # the rest of the queries are run in parallel and cached. Failed queries are left out of the results (and not cached)
+    # Without the analytics cache (ETL_ANALYTICS_CACHE), all the queries are run and nothing is cached
+    queries = parse_queries()
+    names = names or list(queries)
+    engine = engine or create_pool_engine()
+    with track("analytics.get_results") as record:
+        try:
+            cached = ANALYTICS_CACHE
+            version = warehouse_version(engine) if cached else None
+            results = {} if refresh or not cached else {name: read_cached(version, name) for name in names}
+            missing = [name for name in names if results.get(name) is None]
+            if missing:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    frames = executor.map(lambda name: run_query(engine, name, queries[name]), missing)
+                    for name, df in zip(missing, frames):
+                        if df is not None and cached:
+                            write_cached(version, name, df)
+                        results[name] = df
+            failed = [name for name in names if results[name] is None]
+            record["rows_out"] = len(names) - len(failed)
+            record["cache_hits"] = len(names) - len(missing)
+            record["failed"] = len(failed)
+            logger.info(
+                f"Success: {len(names) - len(failed)} analytics results of version {version}, {len(missing)} queried, "
+                f"{len(failed)} failed"
+            )
+            return {name: results[name] for name in names if results[name] is not None}
+        except Exception as e:
+            logger.error(f"Error: getting analytics results: {str(e)}")
+            raise
+
+
+def prune_cache(version):
+    # Removes results cached for warehouse versions older than given one
+    if os.path.isdir(cache_dir):
+        for entry in os.listdir(cache_dir):
+            if entry.isdigit() and int(entry) < version:
+                shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+    for key in [key for key in memory_cache if key[0] < version]:
+        del memory_cache[key]
+
+
+def warm_cache(engine=None):
+    # Runs all the queries for the current warehouse version (right after a load) and drops older cached results
+    # Does nothing without the analytics cache, since the warehouse version is not bumped by loads then
+    if not ANALYTICS_CACHE:
+        logger.info("Analytics cache is off (ETL_ANALYTICS_CACHE), cache not warmed")
+        return {}
+    engine = engine or create_pool_engine()
+    version = warehouse_version(engine)
+    results = get_results(engine=engine)
+    prune_cache(version)
+    return results
@@ -5,15 +5,32 @@ Purpose:
 - loads the data from the bunch of excel sheets
 - performs necessary validation for columns of interest, handles their absence if needed
 - concatenate the extracted dataframes on basis of separate sheets, making the monolitic dataframe as the result
-- saves (staging) data as json file, ready for further transformations
+- saves (staging) data as arrow, parquet or json file (see staging.py), ready for further transformations
+- optionally streams the sheets in fixed-size batches straight to the staging file, keeping memory usage flat
+- optionally extracts incrementally, re-parsing only new or changed workbooks/sheets and reusing cached output for the rest
+- lists the sheets of all the workbooks and extracts a single sheet into its own staging file, so sheets can be extracted as parallel tasks
+- optionally (compact dtypes, see schema.py) downcasts integer columns, so staging data is saved in fixed compact types
+- reads source files with the reader of their file type (see source_readers): excel workbooks sheet by sheet,
+  CSV, Parquet and Arrow IPC files with multithreaded arrow readers
 """
 
 import pandas as pd
+import openpyxl
 import os
 import logging
 import numpy as np
 import json
 import sys
+import hashlib
+import zipfile
+import xml.etree.ElementTree as ET
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+from staging import staging_path, staging_writer, write_staging, read_staging, part_staging_path, clear_parts
+from metrics import track
+from schema import staging_columns, compact_staging_columns, compact_dtypes_mode, downcast
 
 
 # Set-up logging
@@ -22,7 +39,11 @@ def setup_logger():
     logger = logging.getLogger("data_extraction")
     logger.setLevel(logging.INFO)
 
-    file_handler = logging.FileHandler(log_file_path)
+    # Handlers are added once per process, the log file is opened with the first message (not at import)
+    if logger.handlers:
+        return logger
+
+    file_handler = logging.FileHandler(log_file_path, delay=True)
     console_handler = logging.StreamHandler(sys.stdout)
 
     formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -37,47 +58,138 @@ def setup_logger():
 
 logger = setup_logger()
 
-# Paths and required columns needed to extract data from excel files
-paths = ["/opt/expdir/data/source.xlsx"]
-required_columns = [
-    "User ID",
-    "Pol",
-    "Earnings",
-    "Job_Success",
-    "Ratings",
-    "Total_Hours",
-    "Price_per_hour",
-    "Main profession",
-    "Title",
-    "Country",
-    "City",
-    "Completed_Jobs",
-    "country_code",
-    "Region",
-    "measure_code",
-]
-
-output_path = "/opt/expdir/data/staging_df.json"
-
-
-def load_excel_sheets():
-    # Loading sheets from excel files
+# Paths (comma-separated, of any file type in source_readers) and required columns needed to extract data
+# from source files (columns are declared in schema.py)
+paths = [path.strip() for path in os.environ.get("ETL_SOURCE_PATHS", "/opt/expdir/data/source.xlsx").split(",") if path.strip()]
+required_columns = list(staging_columns)
+
+# Number of worker processes used for parsing sheets (1 means sheets are parsed in the current process)
+max_workers = int(os.environ.get("ETL_EXTRACT_WORKERS", "1"))
+
+# Streaming mode and number of rows per batch when extraction is streamed (see stream_extract)
+streaming_mode = os.environ.get("ETL_EXTRACT_STREAMING", "false").lower() == "true"
+batch_size = int(os.environ.get("ETL_EXTRACT_BATCH_SIZE", "50000"))
+
+# Incremental mode, manifest with workbook/sheet fingerprints and directory with cached (already extracted) sheets
+incremental_mode = os.environ.get("ETL_EXTRACT_INCREMENTAL", "false").lower() == "true"
+manifest_path = "/opt/expdir/data/extract_manifest.json"
+cache_dir = "/opt/expdir/data/extract_cache"
+
+# Workbook opened once per worker process, see init_sheet_worker
+_worker_workbook = None
+
+
+def init_sheet_worker(path):
+    # Opens the workbook once per worker process, so every sheet handled by the worker is parsed from the same file
+    global _worker_workbook
+    _worker_workbook = pd.ExcelFile(path)
+
+
+def parse_sheet(name):
+    # Parses a single sheet from the workbook opened by init_sheet_worker
+    return _worker_workbook.parse(name)
+
+
+def load_workbook_sheets(path, workers=1, sheet_names=None):
+    # Parses all (or only given) sheets of one workbook, opening the file only once (per process)
+    # With more than one worker, sheets are converted to dataframes across a process pool
+    with pd.ExcelFile(path) as xl:
+        sheet_names = xl.sheet_names if sheet_names is None else sheet_names
+        if workers > 1 and len(sheet_names) > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(sheet_names)), initializer=init_sheet_worker, initargs=(path,)
+            ) as executor:
+                frames = list(executor.map(parse_sheet, sheet_names))
+        else:
+            frames = [xl.parse(name) for name in sheet_names]
+    return sheet_names, frames
+
+
+def csv_convert_options():
+    # Column types of CSV files are taken from schema.py instead of being inferred (the streaming reader would infer them
+    # from the first block only). Raw (object) columns are read as strings. Empty strings are missing values, as in excel sheets
+    column_types = {col: (pa.string() if dtype == "object" else pa.from_numpy_dtype(np.dtype(dtype))) for col, dtype in staging_columns.items()}
+    return pacsv.ConvertOptions(column_types=column_types, strings_can_be_null=True)
+
+
+def read_csv_file(path, workers=1, sheet_names=None):
+    # CSV file read by the multithreaded arrow reader, as a single part (column types, see csv_convert_options)
+    table = pacsv.read_csv(path, read_options=pacsv.ReadOptions(use_threads=True), convert_options=csv_convert_options())
+    return [""], [table.to_pandas()]
+
+
+def read_parquet_file(path, workers=1, sheet_names=None):
+    # Parquet file read by the multithreaded arrow reader (memory-mapped), as a single part
+    return [""], [pq.read_table(path, memory_map=True, use_threads=True).to_pandas()]
+
+
+def read_arrow_file(path, workers=1, sheet_names=None):
+    # Arrow IPC (feather) file, memory-mapped, as a single part
+    return [""], [pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas()]
+
+
+# Readers by file type. Every reader returns the names of the parts it read and their dataframes
+# Parts of excel workbooks are their sheets, other files are read as a single part named ""
+source_readers = {
+    ".xlsx": load_workbook_sheets,
+    ".xlsm": load_workbook_sheets,
+    ".csv": read_csv_file,
+    ".parquet": read_parquet_file,
+    ".arrow": read_arrow_file,
+    ".feather": read_arrow_file,
+}
+workbook_types = [".xlsx", ".xlsm"]
+
+
+def file_type(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in source_readers:
+        raise ValueError(f"unsupported source file type: {path}")
+    return extension
+
+
+def read_source(path, workers=1, sheet_names=None):
+    # Reads all (or only given) parts of a source file with the reader of its file type
+    return source_readers[file_type(path)](path, workers, sheet_names)
+
+
+def source_parts(path):
+    # Names of the parts of a source file, without reading its data
+    if file_type(path) in workbook_types:
+        with pd.ExcelFile(path) as xl:
+            return xl.sheet_names
+    return [""]
+
+
+def country_codes(df, part_name):
+    # Excel sheets are named after their country (e.g. Serbia0 -> se). Other files hold rows of many countries,
+    # so the codes come from their own country_code column, or from the Country column the same way (Serbia -> se)
+    if part_name:
+        return part_name[:2].lower()
+    if "country_code" in df.columns:
+        return df["country_code"].str.lower()
+    if "Country" in df.columns:
+        return df["Country"].str[:2].str.lower()
+    return pd.NA
+
+
+def tag_part(df, part_name, path):
+    # Adds country_code and measure_code (name of the source file) to a part of the source file
+    return tag_batch(df, country_codes(df, part_name), os.path.splitext(os.path.basename(path))[0])
+
+
+def load_source_files(workers=None):
+    # Loading parts (sheets) of all the source files
     dfs = []
+    workers = workers or max_workers
     try:
         for path in paths:
-            xl = pd.ExcelFile(path)
-            sheet_names = xl.sheet_names
-            country_codes = [name[:2].lower() for name in sheet_names]
-            filename = os.path.splitext(os.path.basename(path))[0]
-
-            for name, code in zip(sheet_names, country_codes):
-                df = pd.read_excel(path, sheet_name=name)
-                df["country_code"] = code
-                df["measure_code"] = filename
-                dfs.append(df)
-        logger.info(f"Success: loaded {len(dfs)} sheets from excel files")
+            part_names, frames = read_source(path, workers)
+            for df, name in zip(frames, part_names):
+                dfs.append(tag_part(df, name, path))
+        logger.info(f"Success: loaded {len(dfs)} sheets/files from source files (workers: {workers})")
     except Exception as e:
-        logger.error(f"Error: loading excel sheets: {str(e)}")
+        logger.error(f"Error: loading source files: {str(e)}")
         raise
     return dfs
 
@@ -85,15 +197,19 @@ def load_excel_sheets():
 def check_columns(df):
     # Checking if all required columns are present in given excel sheets/dataframes.
     # If not, we are adding them, maintaining the desired structure of output
+    # With compact dtypes, integer columns are downcast to their compact types (see schema.py)
     try:
         for col in required_columns:
             if col not in df.columns:
                 df[col] = pd.NA
+        df = df[required_columns]
+        if compact_dtypes_mode:
+            df = downcast(df, compact_staging_columns)
         logger.info(f"Success: all specified columns found in dataframe")
     except Exception as e:
         logger.error(f"Error: validating columns: {str(e)}")
         raise
-    return df[required_columns]
+    return df
 
 
 def combine_dataframes(dfs):
@@ -107,30 +223,269 @@ def combine_dataframes(dfs):
     return combined_df
 
 
-def save_as_json(df):
-    # Saving extracted data as json file
+def save_staging_data(df):
+    # Saving extracted data as staging file, in format selected in staging.py
     try:
-        df.to_json(output_path, orient="records", lines=True)
-        logger.info(f"Success: dataframe saved as json")
+        write_staging(df)
+        logger.info(f"Success: dataframe saved as staging file: {staging_path()}")
     except Exception as e:
-        logger.error(f"Error: saving dataframe as json file: {str(e)}")
+        logger.error(f"Error: saving dataframe as staging file: {str(e)}")
         raise
 
 
-def extract_data():
-    # Function which handles all the operations mentioned above
+def discover_sheets():
+    # Lists the sheets of all the source files in extraction order, every sheet (or whole non-excel file) being one part
+    # (index gives its position). Parts left by a previous run are removed
     try:
-        dfs = load_excel_sheets()
-        validated_dfs = [check_columns(df) for df in dfs]
-        combined_df = combine_dataframes(validated_dfs)
-        save_as_json(combined_df)
-        logger.info("Success: extraction completed")
-        return combined_df
+        sheets = []
+        for path in paths:
+            for sheet_name in source_parts(path):
+                sheets.append({"index": len(sheets), "path": path, "sheet_name": sheet_name})
+        clear_parts()
+        logger.info(f"Success: found {len(sheets)} sheets/files in source files")
+        return sheets
     except Exception as e:
-        logger.error(f"Error: problem in extraction process: {str(e)}")
+        logger.error(f"Error: listing source sheets: {str(e)}")
         raise
 
 
+def extract_sheet(index, path, sheet_name):
+    # Extracts a single sheet (see discover_sheets) into its own staging file and returns the part description
+    with track("extract_sheet") as record:
+        try:
+            _, frames = read_source(path, sheet_names=[sheet_name])
+            df = check_columns(tag_part(frames[0], sheet_name, path))
+            write_staging(df, path=part_staging_path(index))
+            record["rows_out"] = len(df)
+            logger.info(f"Success: sheet '{sheet_name}' of {path} saved as staging file: {part_staging_path(index)}")
+            return {"index": index, "path": path, "sheet_name": sheet_name}
+        except Exception as e:
+            logger.error(f"Error: extracting sheet '{sheet_name}' of {path}: {str(e)}")
+            raise
+
+
+def cell_value(value):
+    # Mirrors the pandas excel reader, which returns integral float cells as integers
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def stream_excel_batches(path, size):
+    # Reads sheets row by row from a workbook opened in read-only mode
+    # Yields dataframes of at most `size` rows, tagged with country_code and measure_code as in load_source_files
+    filename = os.path.splitext(os.path.basename(path))[0]
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            columns = [f"Unnamed: {i}" if col is None else col for i, col in enumerate(header)]
+            width = len(columns)
+            code = ws.title[:2].lower()
+
+            batch = []
+            for row in rows:
+                # Blank rows are skipped, the same way pd.read_excel does
+                if all(value is None for value in row):
+                    continue
+                row = [cell_value(value) for value in row[:width]]
+                batch.append(row + [None] * (width - len(row)))
+                if len(batch) == size:
+                    yield tag_batch(pd.DataFrame(batch, columns=columns), code, filename)
+                    batch = []
+            if batch:
+                yield tag_batch(pd.DataFrame(batch, columns=columns), code, filename)
+    finally:
+        wb.close()
+
+
+def tag_batch(df, code, filename):
+    # Adds the sheet/file identifiers to a streamed batch
+    df["country_code"] = code
+    df["measure_code"] = filename
+    return df
+
+
+def stream_source_batches(path, size):
+    # Yields dataframes of at most `size` rows of a source file (see stream_excel_batches for workbooks)
+    # Parquet row groups, Arrow IPC record batches and CSV blocks (parsed by the arrow streaming reader) are read one at a time
+    if file_type(path) in workbook_types:
+        yield from stream_excel_batches(path, size)
+        return
+    if file_type(path) == ".csv":
+        batches = pacsv.open_csv(path, convert_options=csv_convert_options())
+    elif file_type(path) == ".parquet":
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=size)
+    else:
+        batches = pa.ipc.open_file(pa.memory_map(path)).read_all().to_batches(max_chunksize=size)
+    for batch in batches:
+        for offset in range(0, batch.num_rows, size):
+            yield tag_part(batch.slice(offset, size).to_pandas(), "", path)
+
+
+def stream_extract(size=None):
+    # Streams every sheet in batches, checks the columns of each batch and appends it to the staging file
+    # Only one batch is held in memory at a time
+    size = size or batch_size
+    rows = 0
+    batches = 0
+    try:
+        with staging_writer() as write:
+            for path in paths:
+                for batch in stream_source_batches(path, size):
+                    batch = check_columns(batch)
+                    write(batch)
+                    rows += len(batch)
+                    batches += 1
+        logger.info(f"Success: streamed {rows} rows in {batches} batches to staging file: {staging_path()}")
+    except Exception as e:
+        logger.error(f"Error: streaming excel sheets to staging file: {str(e)}")
+        raise
+    return rows
+
+
+def file_fingerprint(path):
+    # Content fingerprint of the whole workbook
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sheet_fingerprints(path):
+    # Content fingerprint of every sheet, built from the CRCs kept in the xlsx (zip) directory, so nothing is decompressed
+    # Cell values of a sheet also depend on shared strings and styles of the workbook, so those parts are included as well
+    ns_main = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    ns_rel = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+    with zipfile.ZipFile(path) as zf:
+        crcs = {info.filename: info.CRC for info in zf.infolist()}
+        workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+        rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+
+    targets = {rel.get("Id"): rel.get("Target") for rel in rels}
+    shared = f"{crcs.get('xl/sharedStrings.xml')}:{crcs.get('xl/styles.xml')}"
+    fingerprints = {}
+    for sheet in workbook.iter(f"{ns_main}sheet"):
+        target = targets[sheet.get(f"{ns_rel}id")]
+        part = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+        fingerprints[sheet.get("name")] = hashlib.sha256(f"{crcs.get(part)}:{shared}".encode()).hexdigest()
+    return fingerprints
+
+
+def load_manifest():
+    # Loads the manifest of previously extracted workbooks/sheets (empty one if there is none yet)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    # Saves the manifest and removes cached sheets which are not referenced anymore
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    referenced = {sheet["cache"] for entry in manifest.values() for sheet in entry["sheets"].values()}
+    for name in os.listdir(cache_dir):
+        if name not in referenced:
+            os.remove(os.path.join(cache_dir, name))
+
+
+def cache_file(path, sheet_name):
+    # Name of the file holding cached output of given sheet
+    return hashlib.sha256(f"{os.path.abspath(path)}:{sheet_name}".encode()).hexdigest()[:32] + ".arrow"
+
+
+def load_changed_sheets(workers=None):
+    # Incremental counterpart of load_source_files + check_columns
+    # Unchanged workbooks are not opened at all, and only new/changed sheets of changed workbooks are parsed
+    # Output of every freshly parsed sheet is cached, and the manifest is returned together with the (ordered) list of dataframes
+    workers = workers or max_workers
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = load_manifest()
+    new_manifest = {}
+    dfs = []
+    parsed_count = 0
+    try:
+        for path in paths:
+            fingerprint = file_fingerprint(path)
+            entry = manifest.get(path, {"fingerprint": None, "sheets": {}})
+            cached = entry["sheets"]
+            if entry["fingerprint"] != fingerprint:
+                # Files other than workbooks are a single part, their fingerprint is the one of the whole file
+                fingerprints = sheet_fingerprints(path) if file_type(path) in workbook_types else {"": fingerprint}
+            else:
+                fingerprints = {name: sheet["fingerprint"] for name, sheet in cached.items()}
+
+            changed = [
+                name
+                for name, sheet_fingerprint in fingerprints.items()
+                if name not in cached
+                or cached[name]["fingerprint"] != sheet_fingerprint
+                or not os.path.exists(os.path.join(cache_dir, cached[name]["cache"]))
+            ]
+            _, frames = read_source(path, workers, changed) if changed else ([], [])
+            parsed = dict(zip(changed, frames))
+
+            sheets = {}
+            for name, sheet_fingerprint in fingerprints.items():
+                file_name = cache_file(path, name)
+                if name in parsed:
+                    df = check_columns(tag_part(parsed[name], name, path))
+                    write_staging(df, "arrow", os.path.join(cache_dir, file_name))
+                else:
+                    df = read_staging("arrow", os.path.join(cache_dir, file_name))
+                sheets[name] = {"fingerprint": sheet_fingerprint, "cache": file_name}
+                dfs.append(df)
+            new_manifest[path] = {"fingerprint": fingerprint, "sheets": sheets}
+            parsed_count += len(changed)
+        logger.info(f"Success: parsed {parsed_count} new/changed sheets, reused {len(dfs) - parsed_count} cached sheets")
+    except Exception as e:
+        logger.error(f"Error: incremental loading of excel sheets: {str(e)}")
+        raise
+    return dfs, new_manifest
+
+
+def extract_data(workers=None, streaming=None, incremental=None, save=True):
+    # Function which handles all the operations mentioned above
+    # In streaming mode the data is written batch by batch and no combined dataframe is returned
+    # In incremental mode the staging file is rebuilt from cached sheets plus new/changed ones
+    # Without saving (in-process pipeline, see pipeline.py), the combined dataframe is only returned. Streaming needs the staging file
+    if streaming is None:
+        streaming = streaming_mode and save
+    if incremental is None:
+        incremental = incremental_mode
+    with track("extract_data") as record:
+        try:
+            if streaming:
+                record["rows_out"] = stream_extract()
+                logger.info("Success: extraction completed")
+                return None
+            if incremental:
+                validated_dfs, manifest = load_changed_sheets(workers)
+                combined_df = combine_dataframes(validated_dfs)
+                if save:
+                    save_staging_data(combined_df)
+                save_manifest(manifest)
+                record["rows_out"] = len(combined_df)
+                logger.info("Success: extraction completed")
+                return combined_df
+            dfs = load_source_files(workers)
+            validated_dfs = [check_columns(df) for df in dfs]
+            combined_df = combine_dataframes(validated_dfs)
+            if save:
+                save_staging_data(combined_df)
+            record["rows_out"] = len(combined_df)
+            logger.info("Success: extraction completed")
+            return combined_df
+        except Exception as e:
+            logger.error(f"Error: problem in extraction process: {str(e)}")
+            raise
+
+
 """
 # execute the extraction process
 try:
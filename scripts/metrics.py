@@ -0,0 +1,152 @@
+"""
+Performance metrics
+
+Purpose:
+- measures wall time, CPU time, rows in/out, peak RSS and RSS (before, after and change) of ETL stages and transformation steps,
+  along with the peak RSS of the whole process so far
+- writes metrics of every pipeline run into a machine-readable JSON file (one file per run)
+- returns the recorded metrics, so they can be pushed to Airflow XCom
+"""
+
+import os
+import json
+import time
+import fcntl
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# Directory holding one JSON file per pipeline run
+metrics_dir = "/opt/expdir/data/metrics"
+
+# Metrics recorded in the current process, not yet written to the run file
+records = []
+
+
+def current_run_id():
+    # Airflow exposes the DAG run id to the task process, outside of Airflow one id is generated per process
+    run_id = os.environ.get("AIRFLOW_CTX_DAG_RUN_ID")
+    if run_id is None:
+        run_id = os.environ.setdefault("ETL_RUN_ID", datetime.now().strftime("manual__%Y%m%dT%H%M%S"))
+    return run_id
+
+
+# Peaks of the stages being measured (see track), and the peak of the process seen so far
+open_peaks = []
+peak_state = {"process_peak": 0}
+peak_lock = threading.Lock()
+
+
+def high_water_mark():
+    # Peak resident set size since the process started or since the last reset_high_water_mark (VmHWM, Linux only)
+    # Elsewhere, the peak of the process lifetime (ru_maxrss, reported in kilobytes on Linux)
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_high_water_mark():
+    # Resets VmHWM to the current RSS (also resets ru_maxrss). Returns False where that's not possible
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def fold_high_water_mark():
+    # Adds the high-water mark to the peaks of all the stages being measured and to the process peak (called under peak_lock)
+    peak = high_water_mark()
+    for entry in open_peaks:
+        entry["peak"] = max(entry["peak"], peak)
+    peak_state["process_peak"] = max(peak_state["process_peak"], peak)
+    return peak
+
+
+def peak_rss_bytes():
+    # Peak resident set size of the current process so far, including peaks from before high-water mark resets
+    with peak_lock:
+        fold_high_water_mark()
+        return peak_state["process_peak"]
+
+
+def rss_bytes():
+    # Current resident set size of the process (second field of /proc/self/statm, in pages), None where /proc is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def start_peak():
+    # Starts measuring the peak RSS of a stage: the high-water mark so far is folded into the peaks of enclosing stages
+    # (e.g. transform_data around its steps), then it's reset, so the stage only sees its own peak
+    with peak_lock:
+        fold_high_water_mark()
+        entry = {"peak": rss_bytes() or 0, "reset": reset_high_water_mark()}
+        open_peaks.append(entry)
+        return entry
+
+
+def stop_peak(entry):
+    # Peak RSS of the stage, None where the high-water mark can't be reset (it would be the peak of the whole process)
+    with peak_lock:
+        fold_high_water_mark()
+        open_peaks[:] = [open_entry for open_entry in open_peaks if open_entry is not entry]
+        return entry["peak"] if entry["reset"] else None
+
+
+@contextmanager
+def track(stage, rows_in=None):
+    # Measures the enclosed block. Rows (and any additional values) can be set on the yielded record
+    # Peak RSS is the highest RSS during the block (of the whole process, so it includes other threads)
+    record = {"stage": stage, "rows_in": rows_in, "rows_out": None, "status": "success"}
+    rss_before = rss_bytes()
+    peak = start_peak()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    except BaseException:
+        record["status"] = "failed"
+        raise
+    finally:
+        record["wall_time_s"] = round(time.perf_counter() - wall_start, 6)
+        record["cpu_time_s"] = round(time.process_time() - cpu_start, 6)
+        rss_after = rss_bytes()
+        record["peak_rss_bytes"] = stop_peak(peak)
+        record["rss_before_bytes"] = rss_before
+        record["rss_after_bytes"] = rss_after
+        record["rss_delta_bytes"] = None if rss_before is None or rss_after is None else rss_after - rss_before
+        record["process_peak_rss_bytes"] = peak_rss_bytes()
+        record["finished_at"] = datetime.now().isoformat()
+        records.append(record)
+
+
+def write_metrics(run_id=None):
+    # Appends metrics recorded in this process to the JSON file of the run and returns them
+    # The file is locked while it's updated, since tasks of the same run may finish at the same time
+    run_id = run_id or current_run_id()
+    recorded = list(records)
+    records.clear()
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, f"{run_id.replace(':', '_').replace('+', '_')}.json")
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        content = f.read()
+        run = json.loads(content) if content else {"run_id": run_id, "stages": []}
+        run["stages"].extend(recorded)
+        f.seek(0)
+        f.truncate()
+        json.dump(run, f, indent=2)
+    return recorded
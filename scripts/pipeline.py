@@ -0,0 +1,107 @@
+"""
+Pipeline runner
+
+Purpose:
+- runs extraction, validation of extracted data, transformation, validation of transformed data and loading in a single process
+- hands the data over between the stages in memory, instead of writing it to /opt/expdir/data and reading it back
+- optionally (checkpoints) still saves the staging file and parquet files, so the run can be inspected or resumed by the DAG tasks
+- can be run from the CLI (python pipeline.py --checkpoints) or from a single Airflow task (see dags/etl_inprocess_dag.py)
+- pre-warms the cache of analytics results after the load (see analytics.py)
+"""
+
+import argparse
+import logging
+import os
+import sys
+from extract import extract_data
+from transform import transform_data
+from load import load_data
+from validate_extraction import validate_extracted_data
+from validate_transformation import validate_transformed_data
+from analytics import warm_cache
+from metrics import track, write_metrics
+
+
+# Set-up logging
+def setup_logger():
+    log_file_path = "/opt/expdir/data/etl_pipeline_process.log"
+    logger = logging.getLogger("data_pipeline")
+    logger.setLevel(logging.INFO)
+
+    # Handlers are added once per process, the log file is opened with the first message (not at import)
+    if logger.handlers:
+        return logger
+
+    file_handler = logging.FileHandler(log_file_path, delay=True)
+    console_handler = logging.StreamHandler(sys.stdout)
+
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    file_handler.setFormatter(formatter)
+    console_handler.setFormatter(formatter)
+
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+
+    return logger
+
+
+logger = setup_logger()
+
+# Checkpoints: staging file and parquet files are saved as in the DAG, although the data is handed over in memory
+checkpoints_mode = os.environ.get("ETL_PIPELINE_CHECKPOINTS", "false").lower() == "true"
+
+
+def run_pipeline(checkpoints=None, load=True):
+    # Runs all the stages, passing the extracted and transformed dataframes directly to the next stage
+    # Returns the transformed dataframe. Any failed stage stops the pipeline
+    # Extraction never streams here (ETL_EXTRACT_STREAMING is for the DAG tasks), since the next stage needs the dataframe
+    if checkpoints is None:
+        checkpoints = checkpoints_mode
+    with track("run_pipeline") as record:
+        try:
+            logger.info(f"Pipeline started (checkpoints: {checkpoints})")
+            staging_df = extract_data(streaming=False, save=checkpoints)
+            record["rows_in"] = len(staging_df)
+            validate_extracted_data(data=staging_df)
+
+            transformed_df = transform_data(staging_df, save=checkpoints)
+            del staging_df
+            validate_transformed_data(data=transformed_df)
+            record["rows_out"] = len(transformed_df)
+
+            if load:
+                if not load_data(data=transformed_df):
+                    raise RuntimeError("Failed to load data")
+                # Loaded data is committed at this point, so a failed warm-up doesn't fail the run
+                # (a retry would load the data again)
+                try:
+                    warm_cache()
+                except Exception as e:
+                    logger.error(f"Error: warming analytics cache failed: {str(e)}")
+            logger.info("Success: pipeline finished")
+            return transformed_df
+        except Exception as e:
+            logger.error(f"Error: pipeline failed: {str(e)}")
+            raise
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Runs the whole ETL pipeline in a single process")
+    parser.add_argument(
+        "--checkpoints",
+        action="store_true",
+        default=None,
+        help="save staging file and parquet files between the stages (default: ETL_PIPELINE_CHECKPOINTS)",
+    )
+    parser.add_argument("--skip-load", action="store_true", help="stop after validation of transformed data")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        run_pipeline(checkpoints=args.checkpoints, load=not args.skip_load)
+    except Exception:
+        sys.exit(1)
+    finally:
+        write_metrics()
@@ -0,0 +1,113 @@
+"""
+Data schema
+
+Purpose:
+- declares the columns of the staging (extracted) data and of the transformed data, with their (pandas) data types, in one place
+- used by extraction (required columns), staging files (types of columns read from json), transformation (data types) and validators
+- optionally (compact dtypes) declares a fixed, smaller type for integer columns whose values are known to fit (e.g. int32 instead of int64),
+  so every frame and every chunk of a run has the same schema. Float columns keep float64, since float32 would round their values
+- a value not fitting the compact type fails the downcast instead of silently changing the type of the column
+- declares partition columns of partitioned datasets, read as strings instead of inferred types
+"""
+
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+# Compact dtypes mode: integer columns are downcast to compact types (see downcast)
+compact_dtypes_mode = os.environ.get("ETL_COMPACT_DTYPES", "false").lower() == "true"
+
+# Columns of the staging data: raw excel columns plus country_code and measure_code added by extraction
+# Raw columns may mix numbers and strings (e.g. Earnings: $40k+ and 5), those are kept as they are (object)
+staging_columns = {
+    "User ID": "object",
+    "Pol": "int64",
+    "Earnings": "object",
+    "Job_Success": "object",
+    "Ratings": "object",
+    "Total_Hours": "float64",
+    "Price_per_hour": "object",
+    "Main profession": "float64",
+    "Title": "object",
+    "Country": "object",
+    "City": "object",
+    "Completed_Jobs": "float64",
+    "country_code": "object",
+    "Region": "object",
+    "measure_code": "object",
+}
+compact_staging_columns = {
+    "Pol": "int8",
+}
+
+# Columns of the transformed data (also the columns of parquet files, see transform.output_tables)
+transformed_columns = {
+    "user_id": "object",
+    "gender": "object",
+    "earnings_in_thousands": "float64",
+    "job_success_perc": "float64",
+    "rating": "object",
+    "total_hours": "int64",
+    "price_per_hour": "float64",
+    "main_profession": "object",
+    "job_title": "object",
+    "country": "object",
+    "city": "object",
+    "completed_jobs": "int64",
+    "country_code": "object",
+    "region": "object",
+    "measure_code": "object",
+    "pid": "object",
+}
+compact_transformed_columns = {
+    "total_hours": "int32",
+    "completed_jobs": "int32",
+}
+
+# Low-cardinality columns, carried as categoricals in compact mode of transformation (staging names are listed as well,
+# since those columns are encoded already when the staging data is loaded)
+categorical_columns = ["gender", "rating", "country", "region", "country_code", "measure_code", "main_profession"]
+staging_categorical_columns = ["Ratings", "Country", "Region", "country_code", "measure_code"]
+
+numeric_columns = [col for col, dtype in transformed_columns.items() if dtype != "object"]
+
+# Partition columns of partitioned datasets (see transform.save_partitioned_datasets)
+partition_columns = ["measure_code", "country_code"]
+
+
+def json_dtypes(columns):
+    # Types given to pd.read_json, so string and float columns are not inferred
+    # Integer columns are left to inference, since read_json would silently truncate non-integral values
+    return {col: dtype for col, dtype in columns.items() if not dtype.startswith("int")}
+
+
+def hive_partitioning(path):
+    # Partitioning for reading a hive-partitioned dataset (directory), None for a single file
+    # Partition keys are read as strings, as declared, instead of inferring their type (e.g. int32 for measure_code 2023)
+    if not os.path.isdir(path):
+        return None
+    return ds.partitioning(pa.schema([(col, pa.string()) for col in partition_columns]), flavor="hive")
+
+
+def accepted_types(columns, compact_columns):
+    # Dtype names accepted by validation for every column: declared type and compact type (if the column has one)
+    return {col: [dtype] + ([compact_columns[col]] if col in compact_columns else []) for col, dtype in columns.items()}
+
+
+def downcast(df, dtypes):
+    # Converts numeric columns to given (smaller) dtypes. Columns holding other values (strings, categoricals) are left as they are
+    # Raises ValueError if any value (or missing value) doesn't convert exactly, so the type of a column never depends on the data
+    for col, dtype in dtypes.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        if not isinstance(df[col].dtype, np.dtype) or df[col].dtype.kind not in "iuf":
+            continue
+        values = df[col].to_numpy()
+        with np.errstate(all="ignore"):
+            converted = values.astype(dtype)
+        if not np.array_equal(converted.astype(values.dtype), values, equal_nan=values.dtype.kind == "f"):
+            raise ValueError(f"values of column {col} don't fit compact type {dtype} (set ETL_COMPACT_DTYPES=false)")
+        df[col] = converted
+    return df
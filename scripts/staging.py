@@ -0,0 +1,209 @@
+"""
+Staging data helpers
+
+Purpose:
+- defines the format and location of the staging data handed off from extraction to validation and transformation
+- writes staging data as Arrow IPC, Parquet or JSON Lines file (whole dataframe at once or batch by batch)
+- reads staging data back, using memory-mapping for Arrow IPC and Parquet files (whole file at once or in batches)
+- reads schema and row count of the staging data from file metadata, without reading the data
+- defines the location of per-sheet parts of staging/transformed data, used when sheets are processed as separate tasks
+- reads JSON staging data with the declared column types (see schema.py) instead of inferring them
+"""
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import os
+import json
+import shutil
+from contextlib import contextmanager
+from schema import staging_columns, compact_staging_columns, compact_dtypes_mode, json_dtypes, downcast
+
+
+# Selected staging format and the file used for each of the supported formats
+staging_format = os.environ.get("ETL_STAGING_FORMAT", "arrow")
+staging_paths = {
+    "arrow": "/opt/expdir/data/staging_df.arrow",
+    "parquet": "/opt/expdir/data/staging_df.parquet",
+    "json": "/opt/expdir/data/staging_df.json",
+}
+
+
+# Per-sheet parts (staging and transformed data of every sheet) of the fanned-out DAG
+parts_dir = "/opt/expdir/data/parts"
+
+
+def staging_path(fmt=None):
+    # Returns the staging file path for given (or selected) format
+    fmt = fmt or staging_format
+    if fmt not in staging_paths:
+        raise ValueError(f"unsupported staging format: {fmt}")
+    return staging_paths[fmt]
+
+
+def part_staging_path(index, fmt=None):
+    # Staging file of a single sheet (part), in given (or selected) format
+    extension = os.path.splitext(staging_path(fmt))[1]
+    return os.path.join(parts_dir, f"staging_{index:04d}{extension}")
+
+
+def clear_parts():
+    # Removes parts left by a previous run
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    os.makedirs(parts_dir, exist_ok=True)
+
+
+def to_arrow_table(df, schema=None):
+    # Converts a staging dataframe to an arrow table
+    # Raw excel columns may hold numbers and strings at the same time. Arrow columns have a single type, so non-null values
+    # of raw columns (declared as object in schema.py) and of other mixed columns are stored as strings. That way a raw column
+    # has the same type in every batch, whichever values the batch holds. Columns without any value are stored as strings too
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            continue
+        inferred = pd.api.types.infer_dtype(df[col], skipna=True)
+        raw = staging_columns.get(col) == "object" and inferred not in ("string", "empty")
+        if raw or (df[col].dtype == object and inferred in ("mixed", "mixed-integer")):
+            df[col] = df[col].map(lambda value: value if pd.isna(value) else str(value))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    if schema is None:
+        fields = [
+            pa.field(f.name, pa.string()) if pa.types.is_null(f.type) or staging_columns.get(f.name) == "object" else f
+            for f in table.schema
+        ]
+        return table.cast(pa.schema(fields))
+    try:
+        return table.cast(schema)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        raise ValueError(f"batch does not match the staging schema, consider using json staging format: {e}")
+
+
+def write_staging(df, fmt=None, path=None):
+    # Writes the whole staging dataframe in given (or selected) format
+    fmt = fmt or staging_format
+    path = path or staging_path(fmt)
+    if fmt == "json":
+        df.to_json(path, orient="records", lines=True)
+        return
+    table = to_arrow_table(df)
+    if fmt == "parquet":
+        pq.write_table(table, path)
+    else:
+        with pa.ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+
+
+@contextmanager
+def staging_writer(fmt=None, path=None):
+    # Opens the staging file for appending batches and yields the function that writes a single batch
+    # For arrow formats, schema of the first batch is used for all the following batches (raw columns are always strings)
+    fmt = fmt or staging_format
+    path = path or staging_path(fmt)
+    if fmt == "json":
+        with open(path, "w") as f:
+            yield lambda batch: f.write(batch.to_json(orient="records", lines=True))
+        return
+
+    state = {"writer": None, "schema": None}
+
+    def write(batch):
+        table = to_arrow_table(batch, state["schema"])
+        if state["writer"] is None:
+            state["schema"] = table.schema
+            if fmt == "parquet":
+                state["writer"] = pq.ParquetWriter(path, table.schema)
+            else:
+                state["writer"] = pa.ipc.new_file(path, table.schema)
+        state["writer"].write_table(table)
+
+    try:
+        yield write
+    finally:
+        if state["writer"] is not None:
+            state["writer"].close()
+
+
+def read_staging_table(fmt=None, path=None, columns=None):
+    # Reads arrow/parquet staging file as an arrow table. Files are memory-mapped, so no data is copied while reading
+    fmt = fmt or staging_format
+    path = path or staging_path(fmt)
+    if fmt == "parquet":
+        return pq.read_table(path, columns=columns, memory_map=True)
+    source = pa.memory_map(path)
+    table = pa.ipc.open_file(source).read_all()
+    return table.select(columns) if columns is not None else table
+
+
+def staging_metadata(fmt=None, path=None):
+    # Returns schema and row count of the staging data
+    # Parquet: from the footer. Arrow IPC: from the schema and record batch headers of the memory-mapped file
+    # JSON Lines has no metadata: schema is inferred from the first record and lines are counted, without parsing them
+    fmt = fmt or staging_format
+    path = path or staging_path(fmt)
+    if fmt == "parquet":
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        return parquet_file.schema_arrow, parquet_file.metadata.num_rows
+    if fmt == "arrow":
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        return reader.schema, sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    with open(path) as f:
+        first = f.readline()
+        rows = (1 if first.strip() else 0) + sum(1 for line in f if line.strip())
+    schema = pa.Table.from_pylist([json.loads(first)]).schema if first.strip() else pa.schema([])
+    return schema, rows
+
+
+def encode_categorical(table, categorical):
+    # Dictionary-encodes given string columns of an arrow table (pandas categoricals after conversion)
+    for col in categorical:
+        if col in table.column_names and pa.types.is_string(table.schema.field(col).type):
+            index = table.column_names.index(col)
+            table = table.set_column(index, col, table.column(col).dictionary_encode())
+    return table
+
+
+def iter_staging(fmt=None, path=None, size=100000, categorical=None):
+    # Reads the staging data as a series of dataframes with at most `size` rows each
+    fmt = fmt or staging_format
+    path = path or staging_path(fmt)
+    categorical = categorical or []
+    if fmt == "json":
+        with pd.read_json(path, lines=True, chunksize=size, dtype=json_dtypes(staging_columns)) as reader:
+            for df in reader:
+                if compact_dtypes_mode:
+                    df = downcast(df, compact_staging_columns)
+                for col in categorical:
+                    if col in df.columns and df[col].dtype == object:
+                        df[col] = df[col].astype("category")
+                yield df
+        return
+
+    if fmt == "parquet":
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=size)
+    else:
+        # Record batches are zero-copy slices of the memory-mapped file
+        batches = read_staging_table(fmt, path).to_batches(max_chunksize=size)
+    for batch in batches:
+        yield encode_categorical(pa.Table.from_batches([batch]), categorical).to_pandas()
+
+
+def read_staging(fmt=None, path=None, columns=None, categorical=None):
+    # Reads the staging data as a dataframe
+    # String columns listed in `categorical` are returned as pandas categoricals (dictionary-encoded on the arrow side)
+    fmt = fmt or staging_format
+    path = path or staging_path(fmt)
+    categorical = categorical or []
+    if fmt == "json":
+        # JSON has no types, declared ones are used (and compact ones, in compact dtypes mode), see schema.py
+        df = pd.read_json(path, lines=True, dtype=json_dtypes(staging_columns))
+        df = df[columns] if columns is not None else df
+        if compact_dtypes_mode:
+            df = downcast(df, compact_staging_columns)
+        for col in categorical:
+            if col in df.columns and df[col].dtype == object:
+                df[col] = df[col].astype("category")
+        return df
+
+    return encode_categorical(read_staging_table(fmt, path, columns), categorical).to_pandas()
@@ -2,10 +2,16 @@
 Transformation step
 
 Purpose:
-- gets the JSON file made as the result of extraction process
+- gets the staging file (arrow, parquet or json) made as the result of extraction process
 - conducts inital data validation
 - conducts series of transformations
 - conducts the validation before saving the transformed data as parquet filess
+- optionally (compact mode) carries low-cardinality columns as categoricals, saved as dictionary-encoded parquet columns
+- optionally (chunked mode) transforms the staging data chunk by chunk, appending every chunk to parquet files as row groups
+- optionally (partitioned mode) saves the output as hive-partitioned parquet datasets, readable with filter pushdown
+- transforms a single sheet (part) and assembles transformed parts, so sheets can be transformed as parallel tasks
+- defines data types declared in schema.py, optionally (compact dtypes) downcasting integer columns to fixed compact types
+- converts the output to arrow once and writes all the parquet files at the same time, with configurable compression
 """
 
 import pandas as pd
@@ -13,9 +19,26 @@ import os
 import logging
 import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import pyarrow.parquet as pq
+import shutil
 import json
 import sys
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from staging import staging_path, read_staging, iter_staging, part_staging_path, parts_dir
+from metrics import track
+from schema import (
+    transformed_columns,
+    compact_transformed_columns,
+    compact_dtypes_mode,
+    categorical_columns,
+    staging_categorical_columns,
+    partition_columns,
+    downcast,
+)
 
 
 # Set-up logging
@@ -24,7 +47,11 @@ def setup_logger():
     logger = logging.getLogger("data_transformation")
     logger.setLevel(logging.INFO)
 
-    file_handler = logging.FileHandler(log_file_path)
+    # Handlers are added once per process, the log file is opened with the first message (not at import)
+    if logger.handlers:
+        return logger
+
+    file_handler = logging.FileHandler(log_file_path, delay=True)
     console_handler = logging.StreamHandler(sys.stdout)
 
     formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -39,15 +66,65 @@ def setup_logger():
 
 logger = setup_logger()
 
-
-def load_staging_data(file_name="/opt/expdir/data/staging_df.json"):
-    # Loads the staging data from previous (extract) step, saved as json file.
+# Compact mode, low-cardinality columns are carried as categoricals in that mode (see schema.categorical_columns)
+compact_mode = os.environ.get("ETL_TRANSFORM_COMPACT", "false").lower() == "true"
+
+# Copy-on-write execution of transformation steps and per-step memory tracing (see transform_data)
+copy_on_write_mode = os.environ.get("ETL_TRANSFORM_COPY_ON_WRITE", "false").lower() == "true"
+trace_memory_mode = os.environ.get("ETL_TRANSFORM_TRACE_MEMORY", "false").lower() == "true"
+
+# Chunked mode and number of staging rows transformed at once in that mode (see transform_in_chunks)
+chunked_mode = os.environ.get("ETL_TRANSFORM_CHUNKED", "false").lower() == "true"
+chunk_size = int(os.environ.get("ETL_TRANSFORM_CHUNK_SIZE", "100000"))
+
+# Output parquet files: one per DB table plus the whole transformed dataset, used for validation purposes
+# Those files are aligned with schema used later in postgres db. In fact, each table file represents one table
+output_tables = {
+    "user": ["pid", "user_id", "gender", "measure_code", "rating"],
+    "earnings": ["pid", "user_id", "earnings_in_thousands", "price_per_hour"],
+    "jobs": ["pid", "user_id", "total_hours", "job_success_perc", "main_profession", "job_title", "completed_jobs"],
+    "geo": ["pid", "user_id", "country", "city", "region", "country_code"],
+}
+output_paths = {
+    "user": "/opt/expdir/data/user.parquet",
+    "earnings": "/opt/expdir/data/earnings.parquet",
+    "jobs": "/opt/expdir/data/jobs.parquet",
+    "geo": "/opt/expdir/data/geo.parquet",
+    "transformed": "/opt/expdir/data/transformed.parquet",
+}
+
+# Compression codec (e.g. snappy, zstd, gzip or none) and level, dictionary encoding (true, false or comma-separated columns)
+# of output parquet files, and number of files written at the same time
+parquet_compression = os.environ.get("ETL_PARQUET_COMPRESSION", "snappy")
+parquet_compression_level = int(os.environ["ETL_PARQUET_COMPRESSION_LEVEL"]) if os.environ.get("ETL_PARQUET_COMPRESSION_LEVEL") else None
+parquet_dictionary = os.environ.get("ETL_PARQUET_DICTIONARY", "true")
+write_workers = int(os.environ.get("ETL_PARQUET_WRITE_WORKERS", "5"))
+
+# Partitioned mode: every output is saved as a hive-partitioned parquet dataset (directory) instead of a single file
+# Row groups are limited to row_group_size rows and hold column statistics, so readers can skip data they don't need
+partitioned_mode = os.environ.get("ETL_TRANSFORM_PARTITIONED", "false").lower() == "true"
+row_group_size = int(os.environ.get("ETL_PARQUET_ROW_GROUP_SIZE", "100000"))
+dataset_paths = {
+    "user": "/opt/expdir/data/user",
+    "earnings": "/opt/expdir/data/earnings",
+    "jobs": "/opt/expdir/data/jobs",
+    "geo": "/opt/expdir/data/geo",
+    "transformed": "/opt/expdir/data/transformed",
+}
+
+
+def load_staging_data(file_name=None, fmt=None, compact=None):
+    # Loads the staging data from previous (extract) step, saved in format selected in staging.py
+    # In compact mode, low-cardinality string columns are loaded as categoricals
+    if compact is None:
+        compact = compact_mode
     try:
-        df = pd.read_json(file_name, lines=True)
-        logger.info("Success: loaded staging data from json file")
+        file_name = file_name or staging_path(fmt)
+        df = read_staging(fmt, file_name, categorical=staging_categorical_columns if compact else None)
+        logger.info(f"Success: loaded staging data from {file_name}")
         return df
     except Exception as e:
-        logger.error(f"Error: loading json file: {e}")
+        logger.error(f"Error: loading staging file: {e}")
         return None
 
 
@@ -72,7 +149,7 @@ def rename_columns(df):
             "job_success": "job_success_perc",
             "earnings": "earnings_in_thousands",
         }
-        df = df.rename(columns=column_mapping)
+        df.rename(columns=column_mapping, inplace=True)
         logger.info("Success: renamed columns")
         return df
     except Exception as e:
@@ -85,7 +162,7 @@ def dropna_user_id(df):
     # This is first layer of NaN handling, since we want to include only those users with existing ID
     # This is important because later transformations and identification of subject relies on this -ID and -ID derived from this column (see: generate_pid)
     try:
-        df = df.dropna(subset=["user_id"])
+        df.dropna(subset=["user_id"], inplace=True)
         logger.info("Success: dropped rows with NaN user_id")
         return df
     except Exception as e:
@@ -106,11 +183,26 @@ def generate_pid(df):
         return df
 
 
+def remove_seen_users(df, seen_pids):
+    # Chunked counterpart of remove_duplicate_users. Keeps the first occurrence of every pid over all chunks
+    # seen_pids holds pids kept in previous chunks, so only the pid strings (not the rows) are retained between chunks
+    try:
+        df.drop_duplicates(subset=["pid"], keep="first", inplace=True)
+        seen = df["pid"].map(seen_pids.__contains__).astype(bool)
+        df.drop(index=df.index[seen], inplace=True)
+        seen_pids.update(df["pid"])
+        logger.info(f"Success: removed duplicate cases ({len(seen_pids)} unique pids so far)")
+        return df
+    except Exception as e:
+        logger.error(f"Error: removing duplicated cases: {e}")
+        return df
+
+
 def remove_duplicate_users(df):
     # Removes duplicates on basis of (already generated) pid values, keeping the first occurrence
     # Also, by this operation we allow the same users from different measurements/timestamps to be present in dataset (since PID is related to timestamps)
     try:
-        df = df.drop_duplicates(subset=["pid"], keep="first")
+        df.drop_duplicates(subset=["pid"], keep="first", inplace=True)
         logger.info("Success: removed duplicate cases")
         return df
     except Exception as e:
@@ -139,6 +231,9 @@ def fill_na(df, fill_values=None):
 
         for column, value in fill_values.items():
             if column in df.columns:
+                # Fill value has to be one of the categories in case of categorical column
+                if isinstance(df[column].dtype, pd.CategoricalDtype) and value not in df[column].cat.categories:
+                    df[column] = df[column].cat.add_categories([value])
                 df[column] = df[column].fillna(value)
         logger.info("Success: filled NaN values with specified values.")
         return df
@@ -194,6 +289,34 @@ def convert_to_numeric(df):
         return df
 
 
+def clean_numeric_columns(df):
+    # Fused version of remove_symbols, extract_numbers and convert_to_numeric, giving the same results in one pass per column
+    # Each column is converted to strings only once, then symbol removal and number extraction run as arrow compute kernels
+    # Digits are matched as \p{Nd}, which is what Python's \d matches (RE2's \d is ASCII-only). Non-ASCII digits don't cast
+    # to int64, so such columns take the pandas path, as in convert_to_numeric (see benchmarks/numeric_parity.py)
+    try:
+        symbols = {"earnings_in_thousands": "[$+k]", "price_per_hour": "[$]", "job_success_perc": "[%]"}
+        numeric_cols = ["job_success_perc", "earnings_in_thousands", "price_per_hour", "completed_jobs", "total_hours"]
+        for col in numeric_cols:
+            if col in df.columns:
+                values = pa.array(df[col].astype(str).to_numpy(), type=pa.string())
+                if col in symbols:
+                    values = pc.replace_substring_regex(values, symbols[col], "")
+                numbers = pc.struct_field(pc.extract_regex(values, r"(?P<number>\p{Nd}+)"), "number")
+                try:
+                    df[col] = pc.cast(numbers, pa.int64()).to_numpy(zero_copy_only=False)
+                except pa.ArrowInvalid:
+                    # Numbers out of int64 range are handled by pandas, as in convert_to_numeric
+                    df[col] = pd.to_numeric(numbers.to_pandas(), errors="coerce").to_numpy()
+        if "earnings_in_thousands" in df.columns:
+            df["earnings_in_thousands"] *= 1000
+        logger.info("Success: cleaned and converted numeric columns")
+        return df
+    except Exception as e:
+        logger.error(f"Error: cleaning numeric columns: {e}")
+        return df
+
+
 def convert_gender(df):
     # Converts initial gender values, coded as numbers, thus replacing them to female/male
     # Important due to later validation. We want to ensure only 3 possible values are allowed
@@ -227,6 +350,12 @@ def convert_to_uppercase(df):
         ]
         for col in string_cols:
             if col in df.columns:
+                # Categoricals are converted through their categories only, unless uppercasing merges some of them
+                if isinstance(df[col].dtype, pd.CategoricalDtype) and not df[col].isna().any():
+                    categories = df[col].cat.categories.astype(str).str.upper()
+                    if categories.is_unique:
+                        df[col] = df[col].cat.rename_categories(categories)
+                        continue
                 df[col] = df[col].astype(str).str.upper()
         logger.info("Success: converted values to uppercase")
         return df
@@ -235,92 +364,295 @@ def convert_to_uppercase(df):
         return df
 
 
-def define_data_types(df):
-    # Explicitly defines the data types for each column
+def define_data_types(df, compact=False, compact_dtypes=None):
+    # Explicitly defines the data types for each column (declared in schema.py)
+    # In compact mode, low-cardinality columns are defined as categoricals
+    # With compact dtypes, integer columns are then downcast to their compact types (e.g. int32 instead of int64)
+    if compact_dtypes is None:
+        compact_dtypes = compact_dtypes_mode
     try:
-        data_types = {
-            "user_id": str,
-            "gender": str,
-            "earnings_in_thousands": float,
-            "job_success_perc": float,
-            "rating": str,
-            "total_hours": int,
-            "price_per_hour": float,
-            "main_profession": str,
-            "job_title": str,
-            "country": str,
-            "city": str,
-            "completed_jobs": int,
-            "country_code": str,
-            "region": str,
-            "measure_code": str,
-            "pid": str,
-        }
-        df = df.astype(data_types)
+        data_types = {col: (str if dtype == "object" else dtype) for col, dtype in transformed_columns.items()}
+        if compact:
+            data_types.update({col: "category" for col in categorical_columns})
+
+        # Only columns which don't have the defined type yet are converted (and thus copied)
+        # String columns are already strings if they were uppercased in the previous step
+        changed_types = {}
+        for col, data_type in data_types.items():
+            if data_type is str:
+                if df[col].dtype != object or pd.api.types.infer_dtype(df[col], skipna=False) != "string":
+                    changed_types[col] = data_type
+            elif df[col].dtype != pd.api.types.pandas_dtype(data_type):
+                changed_types[col] = data_type
+        converted = df[list(changed_types)].astype(changed_types)
+        for col in changed_types:
+            df[col] = converted[col]
         logger.info("Success: defined data types for columns in dataset")
-        return df
     except Exception as e:
         logger.error(f"Error: defining data types for columns in dataset: {e}")
         return df
+    # Values not fitting the compact types stop the transformation (see schema.downcast)
+    if compact_dtypes:
+        df = downcast(df, compact_transformed_columns)
+    return df
 
 
-def save_parquet_files(df):
-    # Data is being separated into several dataframes, which are further saved as parquet files
+def parquet_options():
+    # Compression and dictionary encoding of output parquet files (see parquet_compression and parquet_dictionary)
+    if parquet_dictionary.lower() in ("true", "false"):
+        use_dictionary = parquet_dictionary.lower() == "true"
+    else:
+        use_dictionary = [col.strip() for col in parquet_dictionary.split(",")]
+    compression = None if parquet_compression.lower() == "none" else parquet_compression
+    return {"compression": compression, "compression_level": parquet_compression_level, "use_dictionary": use_dictionary}
+
+
+def output_arrow_tables(table):
+    # Tables of DB schema (see output_tables) as column selections of the whole transformed table (converted to arrow once),
+    # sharing its buffers, so no data is copied per table
+    tables = {table_name: table.select(columns) for table_name, columns in output_tables.items()}
+    tables["transformed"] = table
+    return tables
+
+
+def write_concurrently(writes):
+    # Runs the writes (functions without arguments) in threads. Arrow encodes and compresses parquet data
+    # without holding the GIL, so the files are written at the same time
+    with ThreadPoolExecutor(max_workers=write_workers) as executor:
+        for future in [executor.submit(write) for write in writes]:
+            future.result()
+
+
+def save_parquet_files(df, partitioned=None):
+    # Data is being separated into several tables, which are further saved as parquet files
+    # In partitioned mode, those are saved as partitioned datasets (see save_partitioned_datasets)
+    if partitioned is None:
+        partitioned = partitioned_mode
+    if partitioned:
+        save_partitioned_datasets(df)
+        return
     try:
-        # Creation of the different dataframes according to DB schema
-        # Those dataframes are aligned with schema used later in postgres db. In fact, each df/parquet file represents one table
-        user_df = df[["pid", "user_id", "gender", "measure_code", "rating"]]
-        earnings_df = df[["pid", "user_id", "earnings_in_thousands", "price_per_hour"]]
-        jobs_df = df[
-            [
-                "pid",
-                "user_id",
-                "total_hours",
-                "job_success_perc",
-                "main_profession",
-                "job_title",
-                "completed_jobs",
-            ]
-        ]
-        geo_df = df[["pid", "user_id", "country", "city", "region", "country_code"]]
-
-        # Saving dataframes as separate parquet files
-        user_df.to_parquet("/opt/expdir/data/user.parquet", engine="pyarrow")
-        earnings_df.to_parquet("/opt/expdir/data/earnings.parquet", engine="pyarrow")
-        jobs_df.to_parquet("/opt/expdir/data/jobs.parquet", engine="pyarrow")
-        geo_df.to_parquet("/opt/expdir/data/geo.parquet", engine="pyarrow")
-
-        # Saving transformed_df as a parquet file
-        # It will be used for validation purposes
-        df.to_parquet("/opt/expdir/data/transformed.parquet", engine="pyarrow")
+        # One table per DB table (see output_tables), plus the whole transformed data, used for validation purposes
+        # Categorical columns (compact mode) are written as dictionary-encoded columns
+        # The pandas index is not kept (it's not part of the data)
+        tables = output_arrow_tables(pa.Table.from_pandas(df, preserve_index=False))
+        options = parquet_options()
+        write_concurrently(
+            partial(pq.write_table, table, output_paths[table_name], **options) for table_name, table in tables.items()
+        )
         logger.info("Success: transformed dataframes are saved as parquet files")
     except Exception as e:
         logger.error(f"Error: saving transformed dataframes as parquet files: {e}")
 
 
-def transform_data(df):
-    # Applying a series of already defined transformations in predefined order
+def with_int32_dictionaries(table):
+    # Dictionary (categorical) columns get int32 indices, so chunks with different number of categories share one schema
+    fields = [
+        pa.field(f.name, pa.dictionary(pa.int32(), f.type.value_type)) if pa.types.is_dictionary(f.type) else f
+        for f in table.schema
+    ]
+    return table.cast(pa.schema(fields, metadata=table.schema.metadata))
+
+
+def save_partitioned_datasets(df, chunk=None):
+    # Saves every output as a parquet dataset, hive-partitioned by measure_code/country_code
+    # Partition columns are added to tables which don't have them, so every table can be filtered by season/country
+    # In chunked mode, every chunk is written as new files into the (existing) partitions
     try:
-        df = (
-            df.pipe(clean_column_names)
-            .pipe(rename_columns)
-            .pipe(dropna_user_id)
-            .pipe(generate_pid)
-            .pipe(remove_duplicate_users)
-            .pipe(fill_na)
-            .pipe(remove_symbols)
-            .pipe(extract_numbers)
-            .pipe(convert_to_numeric)
-            .pipe(convert_gender)
-            .pipe(convert_to_uppercase)
-            .pipe(define_data_types)
-            .pipe(save_parquet_files)
-        )
-        logger.info("Success: data is transformed")
-        return df
+        table = with_int32_dictionaries(pa.Table.from_pandas(df, preserve_index=False))
+        file_options = ds.ParquetFileFormat().make_write_options(write_statistics=True, **parquet_options())
+
+        def write(table_name):
+            columns = output_tables.get(table_name, table.column_names)
+            columns = columns + [col for col in partition_columns if col not in columns]
+            if not chunk:
+                shutil.rmtree(dataset_paths[table_name], ignore_errors=True)
+            ds.write_dataset(
+                table.select(columns),
+                dataset_paths[table_name],
+                format="parquet",
+                partitioning=partition_columns,
+                partitioning_flavor="hive",
+                basename_template=f"part-{chunk or 0}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                file_options=file_options,
+                min_rows_per_group=row_group_size,
+                max_rows_per_group=row_group_size,
+            )
+
+        write_concurrently(partial(write, table_name) for table_name in list(output_tables) + ["transformed"])
+        logger.info("Success: transformed dataframes are saved as partitioned parquet datasets")
     except Exception as e:
-        logger.error(f"Error: main data transformation function failed: {e}")
-        return df
+        logger.error(f"Error: saving transformed dataframes as partitioned parquet datasets: {e}")
+        raise
+
+
+def append_parquet_files(df, writers):
+    # Chunked counterpart of save_parquet_files. Appends the chunk to every output file as a new row group
+    # Writers are opened with the first chunk (see with_int32_dictionaries). The chunk is converted to arrow once
+    try:
+        tables = output_arrow_tables(with_int32_dictionaries(pa.Table.from_pandas(df, preserve_index=False)))
+        for table_name, table in tables.items():
+            if table_name not in writers:
+                writers[table_name] = pq.ParquetWriter(output_paths[table_name], table.schema, **parquet_options())
+
+        def write(table_name):
+            writer = writers[table_name]
+            writer.write_table(tables[table_name].cast(writer.schema))
+
+        write_concurrently(partial(write, table_name) for table_name in tables)
+    except Exception as e:
+        logger.error(f"Error: appending transformed chunk to parquet files: {e}")
+        raise
+
+
+def transformation_steps(compact=False, seen_pids=None):
+    # Series of already defined transformations in predefined order
+    # In chunked mode (seen_pids given), duplicates are removed across all chunks
+    return [
+        clean_column_names,
+        rename_columns,
+        dropna_user_id,
+        generate_pid,
+        remove_duplicate_users if seen_pids is None else partial(remove_seen_users, seen_pids=seen_pids),
+        fill_na,
+        clean_numeric_columns,
+        convert_gender,
+        convert_to_uppercase,
+        partial(define_data_types, compact=compact),
+    ]
+
+
+def step_name(step):
+    # Name of the transformation step (also for steps with bound arguments)
+    return getattr(step, "func", step).__name__
+
+
+def transform_data(df, compact=None, copy_on_write=None, trace_memory=None, save=True):
+    # Applying a series of already defined transformations in predefined order
+    # Without saving (in-process pipeline, see pipeline.py), the transformed dataframe is only returned
+    # With copy-on-write, frames returned by steps share column data, which is copied only when a column is modified
+    # With memory tracing, bytes allocated (peak) and retained by every step are logged
+    # Every step is measured (time, rows, peak RSS) as a sub-stage of transform_data, see metrics.py
+    if compact is None:
+        compact = compact_mode
+    if copy_on_write is None:
+        copy_on_write = copy_on_write_mode
+    if trace_memory is None:
+        trace_memory = trace_memory_mode
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    # Steps rename, drop rows and replace columns of the frame in place, so they work on a shallow copy of the given frame
+    # (column data isn't copied), leaving the caller's frame as it was
+    df = df.copy(deep=False)
+    with track("transform_data", rows_in=len(df)) as record:
+        try:
+            with pd.option_context("mode.copy_on_write", copy_on_write):
+                for step in transformation_steps(compact):
+                    with track(f"transform_data.{step_name(step)}", rows_in=len(df)) as step_record:
+                        if trace_memory:
+                            tracemalloc.reset_peak()
+                            before, _ = tracemalloc.get_traced_memory()
+                        df = step(df)
+                        step_record["rows_out"] = len(df)
+                        if trace_memory:
+                            after, peak = tracemalloc.get_traced_memory()
+                            step_record["allocated_bytes"] = peak - before
+                            logger.info(
+                                f"Memory: {step_name(step)} allocated {peak - before} bytes (peak), retained {after - before} bytes"
+                            )
+                if save:
+                    with track("transform_data.save_parquet_files", rows_in=len(df)) as step_record:
+                        save_parquet_files(df)
+                        step_record["rows_out"] = len(df)
+                record["rows_out"] = len(df)
+            logger.info("Success: data is transformed")
+            return df
+        except Exception as e:
+            logger.error(f"Error: main data transformation function failed: {e}")
+            record["status"] = "failed"
+            return df
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+
+def transform_in_chunks(file_name=None, fmt=None, size=None, compact=None, copy_on_write=None, partitioned=None):
+    # Chunked mode of transform_data. Staging data is transformed chunk by chunk and appended to the output parquet files,
+    # so only one chunk (plus the set of already seen pids) is held in memory, even for datasets larger than memory
+    size = size or chunk_size
+    if compact is None:
+        compact = compact_mode
+    if copy_on_write is None:
+        copy_on_write = copy_on_write_mode
+    if partitioned is None:
+        partitioned = partitioned_mode
+    seen_pids = set()
+    steps = transformation_steps(compact, seen_pids)
+    writers = {}
+    chunks = 0
+    with track("transform_in_chunks", rows_in=0) as record:
+        try:
+            record["rows_out"] = 0
+            file_name = file_name or staging_path(fmt)
+            with pd.option_context("mode.copy_on_write", copy_on_write):
+                for df in iter_staging(fmt, file_name, size, staging_categorical_columns if compact else None):
+                    record["rows_in"] += len(df)
+                    for step in steps:
+                        df = step(df)
+                    if partitioned:
+                        save_partitioned_datasets(df, chunks)
+                    else:
+                        append_parquet_files(df, writers)
+                    record["rows_out"] += len(df)
+                    chunks += 1
+            logger.info(f"Success: data is transformed in {chunks} chunks, {record['rows_out']} rows saved as parquet files")
+            return record["rows_out"]
+        except Exception as e:
+            logger.error(f"Error: chunked data transformation failed: {e}")
+            raise
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+
+def transformed_part_path(index):
+    # Transformed data of a single sheet (part)
+    return os.path.join(parts_dir, f"transformed_{index:04d}.parquet")
+
+
+def transform_part(index, fmt=None, compact=None):
+    # Transforms the staging file of a single sheet (see extract.extract_sheet) and saves it as a transformed part
+    # Categorical columns get int32 dictionaries, so the parts can be concatenated (see assemble_parts)
+    if compact is None:
+        compact = compact_mode
+    df = load_staging_data(part_staging_path(index, fmt), fmt, compact)
+    if df is None:
+        raise ValueError(f"Failed to load staging data of part {index}")
+    df = transform_data(df, compact, save=False)
+    pq.write_table(with_int32_dictionaries(pa.Table.from_pandas(df, preserve_index=False)), transformed_part_path(index))
+    logger.info(f"Success: part {index} is transformed, {len(df)} rows saved as {transformed_part_path(index)}")
+    return index
+
+
+def assemble_parts(indexes, partitioned=None):
+    # Concatenates transformed parts in sheet order and removes users duplicated across sheets (the first one is kept,
+    # as when the whole dataset is transformed at once), then saves the output parquet files
+    with track("assemble_parts") as record:
+        try:
+            tables = [pq.read_table(transformed_part_path(index), memory_map=True) for index in sorted(indexes)]
+            df = pa.concat_tables(tables, promote_options="permissive").to_pandas()
+            record["rows_in"] = len(df)
+            df = remove_duplicate_users(df)
+            df.reset_index(drop=True, inplace=True)
+            save_parquet_files(df, partitioned)
+            record["rows_out"] = len(df)
+            logger.info(f"Success: assembled {len(tables)} transformed parts, {len(df)} rows")
+            return len(df)
+        except Exception as e:
+            logger.error(f"Error: assembling transformed parts: {e}")
+            raise
 
 
 """ 
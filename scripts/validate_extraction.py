@@ -1,7 +1,20 @@
-import pandas as pd
 import os
 import logging
 import sys
+from staging import staging_format, staging_path, read_staging, read_staging_table, staging_metadata
+from metrics import track
+from schema import staging_columns
+from validation_rules import (
+    structural_mode,
+    check_rules,
+    check_file,
+    log_report,
+    assert_report,
+    not_empty,
+    column_count,
+    has_columns,
+    unique_column_names,
+)
 
 
 # Set-up logging
@@ -10,7 +23,11 @@ def setup_logger():
     logger = logging.getLogger("data_extraction_validation")
     logger.setLevel(logging.INFO)
 
-    file_handler = logging.FileHandler(log_file_path)
+    # Handlers are added once per process, the log file is opened with the first message (not at import)
+    if logger.handlers:
+        return logger
+
+    file_handler = logging.FileHandler(log_file_path, delay=True)
     console_handler = logging.StreamHandler(sys.stdout)
 
     formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -25,58 +42,62 @@ def setup_logger():
 
 logger = setup_logger()
 
-# List of required columns for validation
-required_columns = [
-    "User ID",
-    "Pol",
-    "Earnings",
-    "Job_Success",
-    "Ratings",
-    "Total_Hours",
-    "Price_per_hour",
-    "Main profession",
-    "Title",
-    "Country",
-    "City",
-    "Completed_Jobs",
-    "country_code",
-    "Region",
-    "measure_code",
+# List of required columns for validation (declared in schema.py)
+required_columns = list(staging_columns)
+
+
+# Validation rules of extracted data (see validation_rules.py)
+extracted_rules = [
+    not_empty(),
+    column_count(len(required_columns)),
+    has_columns(required_columns),
+    unique_column_names(),
 ]
 
 
-def validate_extracted_data():
+def read_columns(fmt, file_path, columns):
+    # Column-projected read of the staging data (memory-mapped for arrow/parquet formats)
+    if fmt == "json":
+        return read_staging(fmt, file_path, columns)
+    return read_staging_table(fmt, file_path, columns)
+
+
+def validate_extracted_data(fmt=None, structural=None, data=None, path=None):
     # Function which handles validation of extracted data
-    json_path = "/opt/expdir/data/staging_df.json"
-    try:
-        # Check if the JSON file exists at given path
-        assert os.path.exists(json_path), f"Validation failed: JSON file does not exist at path: {json_path}"
-        logger.info(f"Validation passed: JSON file exists at path: {json_path}")
-
-        # Load data from JSON at given path
-        data = pd.read_json(json_path, lines=True)
-
-        # Assert the data is not empty
-        assert not data.empty, "Validation failed: extracted data is empty"
-        logger.info("Validation passed: extracted data is not empty")
-
-        # Assert if column count matches the required columns
-        assert len(data.columns) == len(required_columns), "Column count mismatch"
-        logger.info(f"Validation passed: column count matches the required columns: {len(required_columns)}")
-
-        # Assert if all required columns are present
-        for col in required_columns:
-            assert col in data.columns, f"Validation failed: missing column: {col}"
-            logger.info(f"Validation passed: column '{col}' is present")
-
-        # Check for duplicate column names
-        assert data.columns.duplicated().sum() == 0, "Validation failed: duplicate column names present"
-        logger.info("Validation passed: no duplicate column names found")
-
-        logger.info("All extraction validations passed successfully")
-    except AssertionError as e:
-        logger.error(f"Validation failed: {str(e)}")
-        raise
-    except Exception as e:
-        logger.error(f"Error during validation: {str(e)}")
-        raise
+    # In structural mode, the checks are answered from staging file metadata, without loading the data (see check_file)
+    # Extracted data may also be given in memory (dataframe or arrow table, see pipeline.py), then no file is read
+    # Path of another staging file (e.g. of a single sheet) may be given
+    fmt = fmt or staging_format
+    file_path = path or staging_path(fmt)
+    if structural is None:
+        structural = structural_mode
+    with track("validate_extracted_data") as record:
+        try:
+            # Check if the staging file exists at given path
+            if data is None:
+                assert os.path.exists(file_path), f"Validation failed: staging file does not exist at path: {file_path}"
+                logger.info(f"Validation passed: staging file exists at path: {file_path}")
+
+            # Evaluate all the rules, log the report and fail if any of them is violated
+            if data is not None:
+                report = check_rules(data, extracted_rules)
+            elif structural:
+                schema, num_rows = staging_metadata(fmt, file_path)
+                report = check_file(schema, num_rows, extracted_rules, lambda columns: read_columns(fmt, file_path, columns))
+            else:
+                # Load data from staging file at given path
+                data = read_staging(fmt, file_path)
+                report = check_rules(data, extracted_rules)
+            record["rows_in"] = record["rows_out"] = report["rows"]
+            record["violations"] = len(report["violations"])
+            log_report(report, logger)
+            assert_report(report)
+
+            logger.info("All extraction validations passed successfully")
+            return report
+        except AssertionError as e:
+            logger.error(f"Validation failed: {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"Error during validation: {str(e)}")
+            raise
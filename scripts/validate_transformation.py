@@ -1,8 +1,33 @@
-import pandas as pd
+import pyarrow.dataset as ds
 import pyarrow.parquet as pq
 import logging
 import sys
 import os
+from metrics import track
+from schema import (
+    transformed_columns,
+    compact_transformed_columns,
+    categorical_columns,
+    numeric_columns,
+    accepted_types,
+    hive_partitioning,
+)
+from validation_rules import (
+    structural_mode,
+    check_rules,
+    check_file,
+    parquet_null_counts,
+    log_report,
+    assert_report,
+    not_empty,
+    has_columns,
+    column_types,
+    not_null,
+    allowed_values,
+    non_negative,
+    unique,
+    uppercase,
+)
 
 
 # Set-up logging
@@ -11,7 +36,11 @@ def setup_logger():
     logger = logging.getLogger("data_transformation_validation")
     logger.setLevel(logging.INFO)
 
-    file_handler = logging.FileHandler(log_file_path)
+    # Handlers are added once per process, the log file is opened with the first message (not at import)
+    if logger.handlers:
+        return logger
+
+    file_handler = logging.FileHandler(log_file_path, delay=True)
     console_handler = logging.StreamHandler(sys.stdout)
 
     formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -27,118 +56,105 @@ def setup_logger():
 logger = setup_logger()
 
 
-def validate_transformed_data():
-    parquet_path = "/opt/expdir/data/transformed.parquet"
-    try:
-        # Check if the parquet file exists
-        assert os.path.exists(parquet_path), f"Validation failed: parquet file does not exist at: {parquet_path}"
-        logger.info(f"Validation passed: parquet file exists at: {parquet_path}")
-
-        # Load data from parquet file
-        df = pd.read_parquet(parquet_path)
-
-        # Assert the data is not empty
-        assert not df.empty, "Validation failed: transformed data is empty"
-        logger.info("Validation passed: transformed data is not empty")
-
-        # Validate (expected) column names
-        expected_columns = [
-            "user_id",
-            "gender",
-            "earnings_in_thousands",
-            "job_success_perc",
-            "rating",
-            "total_hours",
-            "price_per_hour",
-            "main_profession",
-            "job_title",
-            "country",
-            "city",
-            "completed_jobs",
-            "country_code",
-            "region",
-            "measure_code",
-            "pid",
-        ]
-        assert set(df.columns) == set(expected_columns), "Validation failed: expected columns are not present"
-        logger.info("Validation passed: expected columns are present")
-
-        # Validate (expected) data types
-        expected_types = {
-            "user_id": "object",
-            "gender": "object",
-            "earnings_in_thousands": "float64",
-            "job_success_perc": "float64",
-            "rating": "object",
-            "total_hours": "int64",
-            "price_per_hour": "float64",
-            "main_profession": "object",
-            "job_title": "object",
-            "country": "object",
-            "city": "object",
-            "completed_jobs": "int64",
-            "country_code": "object",
-            "region": "object",
-            "measure_code": "object",
-            "pid": "object",
-        }
-        for col, expected_type in expected_types.items():
-            assert (
-                df[col].dtype == expected_type
-            ), f"Validation failed: column '{col}' has type {df[col].dtype}, expected {expected_type}"
-        logger.info("Validation passed: data types in specified columns are as expected")
-
-        # Validate no null values
-        assert df.isnull().sum().sum() == 0, "Validation failed: null values found in the dataset"
-        logger.info("Validation passed: no null values found")
-
-        # Validate gender values
-        valid_gender_values = ["MALE", "FEMALE", "UNKNOWN"]
-        assert df["gender"].isin(valid_gender_values).all(), "Validation failed: invalid gender values found"
-        logger.info("Validation passed: gender values are valid")
-
-        # Validate numeric columns (non-negative)
-        numeric_columns = [
-            "earnings_in_thousands",
-            "job_success_perc",
-            "price_per_hour",
-            "completed_jobs",
-            "total_hours",
-        ]
-        for col in numeric_columns:
-            assert (df[col] >= 0).all(), f"Validation failed: negative values found in {col}"
-        logger.info("Validation passed: numeric columns contain only non-negative values")
-
-        # Validate rating values
-        valid_ratings = ["TOP RATED", "UNKNOWN"]
-        assert df["rating"].isin(valid_ratings).all(), "Validation failed: invalid rating values found"
-        logger.info("Validation passed: rating values are valid")
-
-        # Validate pid uniqueness
-        assert df["pid"].is_unique, "Validation failed: duplicate pid values found"
-        logger.info("Validation passed: PID values are unique")
-
-        # Validate uppercase columns/values
-        uppercase_columns = [
-            "user_id",
-            "gender",
-            "rating",
-            "job_title",
-            "country",
-            "city",
-            "country_code",
-            "region",
-            "measure_code",
-            "pid",
-        ]
-        for col in uppercase_columns:
-            assert df[col].str.isupper().all(), f"Validation failed: non-uppercase values found in {col}"
-        logger.info("Validation passed: specified columns contain only uppercase values")
-
-        logger.info("All transformation validations passed successfully")
-    except AssertionError as e:
-        logger.error(f"Validation failed: {str(e)}")
-        raise
-    except Exception as e:
-        logger.error(f"Error during validation: {str(e)}")
-        raise
+# Partitioned mode of transformation step saves transformed data as partitioned dataset (directory)
+partitioned = os.environ.get("ETL_TRANSFORM_PARTITIONED", "false").lower() == "true"
+
+
+# Expected column names and (pandas) data types, declared in schema.py
+# Numeric columns may also have compact types (compact dtypes), low-cardinality columns may be categoricals (compact mode)
+expected_types = accepted_types(transformed_columns, compact_transformed_columns)
+
+uppercase_columns = [
+    "user_id",
+    "gender",
+    "rating",
+    "job_title",
+    "country",
+    "city",
+    "country_code",
+    "region",
+    "measure_code",
+    "pid",
+]
+
+# Validation rules of transformed data, all of them are evaluated and every violation is reported (see validation_rules.py)
+transformed_rules = [
+    not_empty(),
+    has_columns(expected_types, exact=True),
+    column_types(expected_types, categorical_columns),
+    not_null(),
+    allowed_values("gender", ["MALE", "FEMALE", "UNKNOWN"]),
+    *[non_negative(col) for col in numeric_columns],
+    allowed_values("rating", ["TOP RATED", "UNKNOWN"]),
+    unique("pid"),
+    *[uppercase(col) for col in uppercase_columns],
+]
+
+
+def check_metadata(parquet_path, filters=None):
+    # Structural validation: row count, column names and types (and null counts, if not filtered) from parquet footers,
+    # value checks on memory-mapped reads of the columns they need (see check_file)
+    # Partition columns of partitioned dataset are strings (see schema.hive_partitioning), also in the value checks
+    partitioning = hive_partitioning(parquet_path)
+    dataset = ds.dataset(parquet_path, format="parquet", partitioning=partitioning)
+    expression = pq.filters_to_expression(filters) if filters else None
+    num_rows = dataset.count_rows(filter=expression)
+    null_counts = None
+    if not filters:
+        null_counts = parquet_null_counts(fragment.metadata for fragment in dataset.get_fragments())
+        # Partition columns are not stored in the files, their values come from directory names (no data is read)
+        if partitioning is not None:
+            partition_names = dataset.partitioning.schema.names
+            partition_table = dataset.to_table(columns=partition_names)
+            null_counts.update({col: partition_table.column(col).null_count for col in partition_names})
+    return check_file(
+        dataset.schema,
+        num_rows,
+        transformed_rules,
+        lambda columns: pq.read_table(
+            parquet_path, columns=columns, filters=filters, memory_map=True, partitioning=partitioning or "hive"
+        ),
+        key="pid",
+        null_counts=null_counts,
+    )
+
+
+def validate_transformed_data(filters=None, structural=None, data=None):
+    # Filters (e.g. [("measure_code", "=", "SOURCE")]) limit validation to matching partitions of the partitioned dataset
+    # Transformed data is read as an arrow table (memory-mapped, no conversion to pandas) and checked against transformed_rules
+    # In structural mode, only the metadata and the columns needed by value checks are read (see check_metadata)
+    # Transformed data may also be given in memory (dataframe or arrow table, see pipeline.py), then no file is read
+    parquet_path = "/opt/expdir/data/transformed" if partitioned else "/opt/expdir/data/transformed.parquet"
+    if structural is None:
+        structural = structural_mode
+    with track("validate_transformed_data") as record:
+        try:
+            # Check if the parquet file exists
+            if data is None:
+                assert os.path.exists(parquet_path), f"Validation failed: parquet file does not exist at: {parquet_path}"
+                logger.info(f"Validation passed: parquet file exists at: {parquet_path}")
+
+            # Evaluate all the rules, log the report and fail if any of them is violated
+            if data is not None:
+                report = check_rules(data, transformed_rules, key="pid")
+            elif structural:
+                report = check_metadata(parquet_path, filters)
+            else:
+                # Load data from parquet file
+                table = pq.read_table(
+                    parquet_path, filters=filters, memory_map=True, partitioning=hive_partitioning(parquet_path) or "hive"
+                )
+                report = check_rules(table, transformed_rules, key="pid")
+            record["rows_in"] = record["rows_out"] = report["rows"]
+            record["violations"] = len(report["violations"])
+            log_report(report, logger)
+            assert_report(report)
+
+            logger.info("All transformation validations passed successfully")
+            return report
+        except AssertionError as e:
+            logger.error(f"Validation failed: {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"Error during validation: {str(e)}")
+            raise
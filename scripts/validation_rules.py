@@ -0,0 +1,305 @@
+"""
+Validation rules
+
+Purpose:
+- describes validation checks declaratively, as a list of rules (see the rule functions below)
+- evaluates all the rules against a dataframe or an arrow table with vectorized (arrow compute) kernels,
+  converting every checked column to arrow only once and evaluating the checks of dictionary (categorical) columns on their categories
+- collects every violation (number of failing rows/columns and sample rows) into one report, instead of stopping at the first failed check
+- optionally (structural mode) answers schema checks from file metadata alone and reads only the columns needed by value checks
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+from staging import to_arrow_table
+
+
+# Number of sample rows kept for every violation
+sample_size = 5
+
+# Structural mode: schema checks are answered from file metadata (see check_file)
+structural_mode = os.environ.get("ETL_VALIDATION_STRUCTURAL", "false").lower() == "true"
+
+# Checks answered from the schema and row count alone
+schema_checks = ["not_empty", "has_columns", "column_count", "unique_column_names", "column_types"]
+
+
+# Rules checked against the schema (column names and types) and size of the data
+def not_empty():
+    return {"check": "not_empty", "message": "data is not empty"}
+
+
+def has_columns(columns, exact=False):
+    # All the columns must be present. If exact, no other columns are allowed
+    message = "expected columns are present" if exact else "required columns are present"
+    return {"check": "has_columns", "columns": list(columns), "exact": exact, "message": message}
+
+
+def column_count(count):
+    return {"check": "column_count", "count": count, "message": f"column count matches the required columns: {count}"}
+
+
+def unique_column_names():
+    return {"check": "unique_column_names", "message": "no duplicate column names found"}
+
+
+def column_types(types, categorical=()):
+    # Expected (pandas) dtype names, or lists of accepted names. Columns listed in categorical may also be categoricals
+    return {
+        "check": "column_types",
+        "types": dict(types),
+        "categorical": list(categorical),
+        "message": "data types in specified columns are as expected",
+    }
+
+
+# Rules checked against values, row by row
+def not_null(columns=None):
+    # Checks all the columns if columns are not given
+    return {"check": "not_null", "columns": columns, "message": "no null values found"}
+
+
+def allowed_values(column, values):
+    return {"check": "allowed_values", "column": column, "values": list(values), "message": f"{column} values are valid"}
+
+
+def non_negative(column):
+    return {"check": "non_negative", "column": column, "message": f"{column} contains only non-negative values"}
+
+
+def unique(column):
+    return {"check": "unique", "column": column, "message": f"{column} values are unique"}
+
+
+def uppercase(column):
+    return {"check": "uppercase", "column": column, "message": f"{column} contains only uppercase values"}
+
+
+def column_names(data):
+    # Pandas index may be stored as a column of arrow tables (read from parquet files), it's not part of the data
+    if isinstance(data, pd.DataFrame):
+        return list(data.columns)
+    return [name for name in data.column_names if not name.startswith("__index_level_")]
+
+
+def type_names(data):
+    # Pandas dtype names of the columns, for arrow tables those the columns get after conversion to pandas
+    if isinstance(data, pd.DataFrame):
+        return {col: ("category" if isinstance(dtype, pd.CategoricalDtype) else str(dtype)) for col, dtype in data.dtypes.items()}
+    names = {}
+    for field in data.schema:
+        if pa.types.is_dictionary(field.type):
+            names[field.name] = "category"
+        else:
+            names[field.name] = np.dtype(field.type.to_pandas_dtype()).name
+    return names
+
+
+def arrow_column(data, col):
+    # Column as an arrow array. Dataframe columns are converted (mixed columns as strings, see staging.to_arrow_table)
+    if isinstance(data, pd.DataFrame):
+        return to_arrow_table(data[[col]]).column(0)
+    return data.column(col)
+
+
+def failing_rows(column, predicate, nulls_fail):
+    # Boolean array marking failing rows. For dictionary columns, the predicate is evaluated on the dictionary only
+    # and mapped to the rows through the indices, so the values are compared once per category instead of once per row
+    chunks = []
+    for chunk in column.chunks:
+        if pa.types.is_dictionary(chunk.type):
+            failed = pc.take(predicate(chunk.dictionary), chunk.indices)
+        else:
+            failed = predicate(chunk)
+        chunks.append(pc.fill_null(failed, nulls_fail))
+    return pa.chunked_array(chunks, pa.bool_())
+
+
+def duplicated_rows(column):
+    # Marks all the occurrences of duplicated values (one hashing pass, the second one only if duplicates exist)
+    counts = pc.value_counts(column)
+    duplicated = counts.field("values").filter(pc.greater(counts.field("counts"), 1))
+    if len(duplicated) == 0:
+        return None
+    return pc.is_in(column, value_set=duplicated)
+
+
+# Row checks: (predicate returning failing values, whether null values fail the check)
+# Null values fail allowed_values and non_negative (as with pandas isin/comparisons), uppercase skips them (as str.isupper)
+row_checks = {
+    "allowed_values": (lambda rule: lambda values: pc.invert(pc.is_in(values, value_set=pa.array(rule["values"]))), True),
+    "non_negative": (lambda rule: lambda values: pc.less(values, 0), True),
+    "uppercase": (lambda rule: lambda values: pc.invert(pc.utf8_is_upper(values)), False),
+}
+
+
+def sample_rows(mask, columns):
+    # First failing rows, with values of given columns (checked column and key column, e.g. pid)
+    rows = pc.indices_nonzero(mask).slice(0, sample_size).to_pylist()
+    return [{"row": row, **{name: column[row].as_py() for name, column in columns.items()}} for row in rows]
+
+
+def check_schema(data, rule, names, types, rows):
+    # Evaluates a schema rule. Returns number of failing items (columns) and samples
+    check = rule["check"]
+    if check == "not_empty":
+        return (0 if rows > 0 else 1), []
+    if check == "has_columns":
+        missing = [col for col in rule["columns"] if col not in names]
+        extra = [col for col in names if col not in rule["columns"]] if rule["exact"] else []
+        return len(missing) + len(extra), [{"missing": col} for col in missing] + [{"unexpected": col} for col in extra]
+    if check == "column_count":
+        return (0 if len(names) == rule["count"] else 1), [{"count": len(names), "expected": rule["count"]}]
+    if check == "unique_column_names":
+        duplicated = sorted({col for col in names if names.count(col) > 1})
+        return len(duplicated), [{"duplicated": col} for col in duplicated]
+    if check == "column_types":
+        wrong = []
+        for col, expected in rule["types"].items():
+            actual = types.get(col)
+            accepted = expected if isinstance(expected, list) else [expected]
+            if actual is None or actual in accepted or (col in rule["categorical"] and actual == "category"):
+                continue
+            wrong.append({"column": col, "type": actual, "expected": expected})
+        return len(wrong), wrong
+    raise ValueError(f"unknown validation check: {check}")
+
+
+def check_rules(data, rules, key=None, num_rows=None, null_counts=None):
+    # Evaluates all the rules against a dataframe or an arrow table and returns the report with every violation
+    # Every column used by value rules is converted to arrow once and shared by all the rules on it
+    # Row count and null counts may be given from file metadata, to evaluate rules against an empty table of the file schema
+    names = column_names(data)
+    types = type_names(data)
+    rows = len(data) if isinstance(data, pd.DataFrame) else data.num_rows
+    rows = rows if num_rows is None else num_rows
+    null_counts = null_counts or {}
+    columns = {}
+
+    def column(col):
+        if col not in columns:
+            columns[col] = arrow_column(data, col)
+        return columns[col]
+
+    results = []
+    for rule in rules:
+        check = rule["check"]
+        result = {"check": check, "column": rule.get("column"), "message": rule["message"], "failed": 0, "sample": []}
+        results.append(result)
+
+        if check == "not_null":
+            # Null counts are kept by arrow arrays, so no extra pass over the data is needed
+            for col in rule["columns"] or names:
+                if col not in names:
+                    continue
+                nulls = null_counts[col] if col in null_counts else column(col).null_count
+                if nulls:
+                    result["failed"] += nulls
+                    result["sample"].append({"column": col, "nulls": nulls})
+            continue
+
+        if check not in row_checks and check != "unique":
+            result["failed"], result["sample"] = check_schema(data, rule, names, types, rows)
+            continue
+
+        col = rule["column"]
+        if col not in names:
+            result["failed"], result["sample"] = rows, [{"missing": col}]
+            continue
+        if check == "unique":
+            mask = duplicated_rows(column(col))
+        else:
+            predicate, nulls_fail = row_checks[check]
+            mask = failing_rows(column(col), predicate(rule), nulls_fail)
+        failed = 0 if mask is None else pc.sum(mask).as_py() or 0
+        if failed:
+            result["failed"] = failed
+            sample_columns = {col: column(col)}
+            if key is not None and key in names:
+                sample_columns[key] = column(key)
+            result["sample"] = sample_rows(mask, sample_columns)
+
+    violations = [result for result in results if result["failed"]]
+    return {"rows": rows, "checks": len(results), "results": results, "violations": violations}
+
+
+def rule_columns(rules, names, key=None):
+    # Columns needed to evaluate given value rules (and the key column of samples), in the order of the data
+    needed = {key}
+    for rule in rules:
+        if rule["check"] == "not_null":
+            needed.update(rule["columns"] or names)
+        else:
+            needed.add(rule.get("column"))
+    return [col for col in names if col in needed]
+
+
+def parquet_null_counts(files):
+    # Null counts of columns from the statistics in parquet footers (FileMetaData of every file), without reading any data
+    # Columns without statistics in some of the row groups are left out
+    null_counts = {}
+    missing = set()
+    for metadata in files:
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            for j in range(row_group.num_columns):
+                chunk = row_group.column(j)
+                col = chunk.path_in_schema
+                statistics = chunk.statistics
+                if statistics is None or not statistics.has_null_count:
+                    missing.add(col)
+                    continue
+                null_counts[col] = null_counts.get(col, 0) + statistics.null_count
+    return {col: nulls for col, nulls in null_counts.items() if col not in missing}
+
+
+def check_file(schema, num_rows, rules, read_columns, key=None, null_counts=None):
+    # Structural validation of a file (or dataset), based on its metadata:
+    # - schema rules are answered from the schema and row count, not_null from null counts (e.g. parquet statistics) if known
+    # - remaining (value) rules are evaluated on the columns they need only, read by read_columns(columns)
+    empty = schema.empty_table()
+    names = column_names(empty)
+    null_counts = null_counts or {}
+    metadata_rules = [
+        rule
+        for rule in rules
+        if rule["check"] in schema_checks
+        or (rule["check"] == "not_null" and all(col in null_counts for col in (rule["columns"] or names)))
+    ]
+    data_rules = [rule for rule in rules if all(rule is not metadata_rule for metadata_rule in metadata_rules)]
+
+    report = check_rules(empty, metadata_rules, num_rows=num_rows, null_counts=null_counts)
+    results = {id(rule): result for rule, result in zip(metadata_rules, report["results"])}
+    if data_rules:
+        data_report = check_rules(read_columns(rule_columns(data_rules, names, key)), data_rules, key)
+        results.update({id(rule): result for rule, result in zip(data_rules, data_report["results"])})
+
+    results = [results[id(rule)] for rule in rules]
+    violations = [result for result in results if result["failed"]]
+    return {"rows": num_rows, "checks": len(results), "results": results, "violations": violations}
+
+
+def log_report(report, logger):
+    # Logs every evaluated rule. Violations are logged with number of failing rows (columns) and samples
+    for result in report["results"]:
+        if result["failed"]:
+            logger.error(
+                f"Validation failed: {result['check']}"
+                + (f" on {result['column']}" if result["column"] else "")
+                + f": {result['failed']} failing, sample: {result['sample']}"
+            )
+        else:
+            logger.info(f"Validation passed: {result['message']}")
+
+
+def assert_report(report):
+    # Raises one AssertionError listing all the violations
+    if report["violations"]:
+        summary = "; ".join(
+            f"{result['check']}" + (f" on {result['column']}" if result["column"] else "") + f" ({result['failed']})"
+            for result in report["violations"]
+        )
+        raise AssertionError(f"{len(report['violations'])} of {report['checks']} checks failed: {summary}")
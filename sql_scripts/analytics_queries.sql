@@ -47,8 +47,8 @@ WHERE j.job_success_perc != '0';
 -- Average earnings (in thousands of $, and average price per hour in $)
 
 SELECT g.country AS "Country",
-       ROUND(AVG(e.earnings_in_thousands), 2) AS "Average earnings in thousands of $",
-       ROUND(AVG(e.price_per_hour), 2) AS "Average price per hour in $"
+       ROUND(CAST(AVG(e.earnings_in_thousands) AS numeric), 2) AS "Average earnings in thousands of $",
+       ROUND(CAST(AVG(e.price_per_hour) AS numeric), 2) AS "Average price per hour in $"
 FROM user_schema.user AS f
 INNER JOIN user_schema.earnings AS e ON f.pid = e.pid
 INNER JOIN user_schema.geo AS g ON e.pid = g.pid
@@ -0,0 +1,129 @@
+-- Dashboard queries, reading rollup tables maintained by the load step (ETL_LOAD_REFRESH_ROLLUPS=true, see init.sql)
+-- Counterparts of the queries in analytics_queries.sql, without aggregating the warehouse tables. Results differ where:
+-- - rollups count only users with a geo row (every user loaded by load.py has one)
+-- - user and gender counts are COUNT(*) of users, not COUNT(pid)/COUNT(gender) (same for users with a gender)
+-- - distribution per gender and country counts all users, analytics_queries.sql only those with an earnings row
+
+
+ -- Countries where users come from
+
+SELECT country AS Country,
+       SUM(users) AS "Number of users"
+FROM user_schema.rollup_country
+WHERE country != 'UNKNOWN'
+GROUP BY country
+ORDER BY "Number of users" DESC;
+
+
+-- Gender distribution
+
+SELECT gender,
+       SUM(users) AS number_per_gender
+FROM user_schema.rollup_gender_country
+GROUP BY gender;
+
+
+-- Number of users
+
+SELECT SUM(users) AS count
+FROM user_schema.rollup_country;
+
+
+-- Average price per working hour (whole sample)
+
+SELECT ROUND(CAST(SUM(price_sum) / NULLIF(SUM(price_count), 0) AS numeric), 2) AS "Average price per hour"
+FROM user_schema.rollup_country;
+
+
+-- Average earnings (in thousands of $, whole sample)
+
+SELECT ROUND(CAST(SUM(earnings_sum) / NULLIF(SUM(earnings_count), 0) AS numeric), 2) AS "Average earnings in thousands of $"
+FROM user_schema.rollup_country;
+
+
+-- Average job success (for users where this information is available, whole sample)
+
+SELECT ROUND(CAST(SUM(job_success_sum) / NULLIF(SUM(job_success_count), 0) AS numeric), 2) AS "Average job success"
+FROM user_schema.rollup_country;
+
+
+-- Average earnings (in thousands of $, and average price per hour in $)
+
+SELECT country AS "Country",
+       ROUND(CAST(SUM(earnings_sum) / NULLIF(SUM(earnings_count), 0) AS numeric), 2) AS "Average earnings in thousands of $",
+       ROUND(CAST(SUM(price_sum) / NULLIF(SUM(price_count), 0) AS numeric), 2) AS "Average price per hour in $"
+FROM user_schema.rollup_country
+GROUP BY country
+ORDER BY "Average earnings in thousands of $" DESC;
+
+
+-- Distribution of users per gender and country
+
+SELECT gender,
+       SUM(users) AS "Number per gender",
+       country
+FROM user_schema.rollup_gender_country
+GROUP BY gender,
+         country
+ORDER BY "Number per gender" DESC;
+
+
+-- Number of users per profession
+
+SELECT profession_class AS "profession class",
+       SUM(users) AS "Number of users per profession"
+FROM user_schema.rollup_profession_country
+GROUP BY profession_class
+ORDER BY "Number of users per profession" DESC;
+
+
+-- Average price per hour ($) per profession class
+
+SELECT profession_class AS "profession class",
+       ROUND(CAST(SUM(price_sum) / NULLIF(SUM(price_count), 0) AS numeric), 2) AS "Average price per hour"
+FROM user_schema.rollup_profession_country
+GROUP BY profession_class
+ORDER BY "Average price per hour" DESC;
+
+
+-- Share of professions, per country
+
+SELECT profession_class,
+       country,
+       SUM(users) AS profession_count
+FROM user_schema.rollup_profession_country
+GROUP BY profession_class,
+         country
+ORDER BY country,
+         profession_count DESC;
+
+
+-- Price per hour ($) for each professions, per country
+
+SELECT profession_class,
+       country,
+       SUM(price_sum) / NULLIF(SUM(price_count), 0) AS average_price
+FROM user_schema.rollup_profession_country
+GROUP BY profession_class,
+         country
+ORDER BY country DESC,
+         average_price DESC;
+
+
+-- professions of top 5 most paid users (earning in thousands $), per country
+-- Top 5 of every measure_code/country slice are kept, so top 5 per country are among them
+
+ WITH ranked_users AS
+  (SELECT profession_class,
+          country,
+          earnings_in_thousands,
+          ROW_NUMBER() OVER (PARTITION BY country
+                             ORDER BY earnings_in_thousands DESC) AS rank
+   FROM user_schema.rollup_top_earners)
+SELECT profession_class,
+       country,
+       earnings_in_thousands
+FROM ranked_users
+WHERE rank <= 5
+ORDER BY country DESC,
+         rank ASC;
\ No newline at end of file
@@ -0,0 +1,67 @@
+-- Profession/country queries of analytics_queries.sql over the star schema (see init.sql)
+-- Joins and groupings use narrow integer keys, profession class comes from dim_profession
+
+
+-- Number of users per profession
+
+SELECT p.profession_class AS "profession class",
+       COUNT(*) AS "Number of users per profession"
+FROM star_schema.fact_user AS f
+INNER JOIN star_schema.dim_profession AS p ON f.profession_key = p.profession_key
+GROUP BY p.profession_class
+ORDER BY "Number of users per profession" DESC;
+
+
+-- Average price per hour ($) per profession class
+
+SELECT p.profession_class AS "profession class",
+       ROUND(CAST(AVG(f.price_per_hour) AS numeric), 2) AS "Average price per hour"
+FROM star_schema.fact_user AS f
+INNER JOIN star_schema.dim_profession AS p ON f.profession_key = p.profession_key
+GROUP BY p.profession_class
+ORDER BY "Average price per hour" DESC;
+
+
+-- Share of professions, per country
+
+SELECT p.profession_class,
+       c.country,
+       COUNT(*) AS profession_count
+FROM star_schema.fact_user AS f
+INNER JOIN star_schema.dim_profession AS p ON f.profession_key = p.profession_key
+INNER JOIN star_schema.dim_country AS c ON f.country_key = c.country_key
+GROUP BY p.profession_class,
+         c.country
+ORDER BY c.country,
+         profession_count DESC;
+
+
+-- Average earnings (in thousands of $, and average price per hour in $), per country
+
+SELECT c.country AS "Country",
+       ROUND(CAST(AVG(f.earnings_in_thousands) AS numeric), 2) AS "Average earnings in thousands of $",
+       ROUND(CAST(AVG(f.price_per_hour) AS numeric), 2) AS "Average price per hour in $"
+FROM star_schema.fact_user AS f
+INNER JOIN star_schema.dim_country AS c ON f.country_key = c.country_key
+GROUP BY c.country
+ORDER BY "Average earnings in thousands of $" DESC;
+
+
+-- professions of top 5 most paid users (earning in thousands $), per country
+
+ WITH ranked_users AS
+  (SELECT f.profession_key,
+          f.country_key,
+          f.earnings_in_thousands,
+          ROW_NUMBER() OVER (PARTITION BY f.country_key
+                             ORDER BY f.earnings_in_thousands DESC) AS rank
+   FROM star_schema.fact_user AS f)
+SELECT p.profession_class,
+       c.country,
+       ru.earnings_in_thousands
+FROM ranked_users AS ru
+INNER JOIN star_schema.dim_profession AS p ON ru.profession_key = p.profession_key
+INNER JOIN star_schema.dim_country AS c ON ru.country_key = c.country_key
+WHERE ru.rank <= 5
+ORDER BY c.country DESC,
+         ru.rank ASC;
\ No newline at end of file